@@ -0,0 +1,19 @@
+# Generated by Django 5.2.17 on 2026-08-27 21:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas', '0003_initial'),
+        ('odontologos', '0002_initial'),
+        ('pacientes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['fecha', 'estado'], name='idx_cita_fecha_estado'),
+        ),
+    ]
@@ -165,6 +165,8 @@ class Cita(models.Model):
             Index(fields=['id_consultorio', 'fecha'], name='idx_cita_consul_fecha'),
             Index(fields=['id_paciente', 'fecha'], name='idx_cita_paciente_fecha'),
             Index(fields=['estado', 'fecha'], name='idx_cita_estado_fecha'),
+            # Reportes: agregados por rango de fecha con conteos por estado
+            Index(fields=['fecha', 'estado'], name='idx_cita_fecha_estado'),
             Index(fields=['id_paciente', 'id_odontologo', 'cancelada_en'], name='idx_cita_po_canceladaen'),
             Index(fields=['cancelada_por_rol', 'cancelada_en'], name='idx_cita_cancel_porrol_en'),
             Index(fields=['estado', 'id_consultorio', 'fecha'], name='idx_cita_est_cons_fecha'),
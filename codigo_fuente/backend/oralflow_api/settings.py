@@ -113,9 +113,37 @@ DATABASES = {
         "PASSWORD": config("DB_PASSWORD"),
         "HOST": config("DB_HOST"),
         "PORT": config("DB_PORT"),
+        # Conexiones persistentes: sin esto cada request paga el handshake
+        # TCP+TLS+auth contra Postgres. El health check descarta sockets
+        # muertos antes de reutilizarlos.
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# ==========================
+# Cache
+# ==========================
+# Con varios workers (gunicorn) la LocMemCache por defecto es por proceso:
+# los throttles y los contadores de login cuentan por worker y los límites
+# se multiplican por N. Si hay REDIS_URL configurado se usa el backend Redis
+# de Django para que todos los procesos compartan estado; sin él se cae al
+# LocMem explícito (desarrollo de un solo proceso).
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 # ==========================
 # Validación de contraseñas
 # ==========================
@@ -133,6 +161,16 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Argon2id primero: usa la implementación en C de libargon2, mucho más
+# rápida por login que el PBKDF2 por defecto a margen de seguridad
+# equivalente. Los hashes PBKDF2 existentes se re-encriptan solos en el
+# siguiente login exitoso.
+PASSWORD_HASHERS = [
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+]
+
 # Tiempo de expiración del token de restablecimiento de contraseña (en segundos)
 PASSWORD_RESET_TIMEOUT = 1800
 
@@ -197,6 +235,7 @@ REST_FRAMEWORK = {
         "anon": "20/min",
         "user": "1000/day",
         "password_reset_request": "5/hour",
+        "password_reset_cedula": "3/hour",
     },
 }
 
@@ -124,7 +124,10 @@ class AntecedenteSerializer(serializers.ModelSerializer):
         }
 
     def validate_nombre(self, value):
-        qs = Antecedente.objects.annotate(nl=Lower('nombre')).filter(nl=value.lower())
+        # alias() en lugar de annotate(): LOWER(nombre) solo se usa en el
+        # WHERE (donde aprovecha el índice de uq_antecedente_nombre_ci) y
+        # no se agrega como columna al SELECT
+        qs = Antecedente.objects.alias(nl=Lower('nombre')).filter(nl=value.lower())
         if self.instance:
             qs = qs.exclude(pk=self.instance.pk)
         if qs.exists():
@@ -132,6 +135,11 @@ class AntecedenteSerializer(serializers.ModelSerializer):
         return value
 
     def get_en_uso(self, obj):
+        # El viewset anota _en_uso con un EXISTS; la consulta individual
+        # queda solo como respaldo si el objeto llega sin anotar
+        en_uso = getattr(obj, '_en_uso', None)
+        if en_uso is not None:
+            return en_uso
         return PacienteAntecedente.objects.filter(id_antecedente=obj).exists()
 
 
@@ -155,18 +163,23 @@ class PacienteAntecedenteSerializer(serializers.ModelSerializer):
         }
 
     def validate(self, attrs):
-        paciente = attrs.get('id_paciente') or getattr(self.instance, 'id_paciente', None)
-        antecedente = attrs.get('id_antecedente') or getattr(self.instance, 'id_antecedente', None)
-        relacion = attrs.get('relacion_familiar') or getattr(self.instance, 'relacion_familiar', None)
+        # En creación no se pre-consulta: el índice único compuesto
+        # (uq_paciente_antecedente_rel) ya garantiza la unicidad y el
+        # IntegrityError se traduce en create(). Solo en actualización,
+        # donde update() no captura IntegrityError, se mantiene el chequeo.
+        if self.instance is None:
+            return attrs
+
+        paciente = attrs.get('id_paciente') or self.instance.id_paciente
+        antecedente = attrs.get('id_antecedente') or self.instance.id_antecedente
+        relacion = attrs.get('relacion_familiar') or self.instance.relacion_familiar
 
         if paciente and antecedente and relacion:
-            qs = PacienteAntecedente.objects.filter(
+            qs = PacienteAntecedente.objects.only('pk').filter(
                 id_paciente=paciente,
                 id_antecedente=antecedente,
                 relacion_familiar=relacion,
-            )
-            if self.instance:
-                qs = qs.exclude(pk=self.instance.pk)
+            ).exclude(pk=self.instance.pk)
             if qs.exists():
                 raise serializers.ValidationError(
                     {"non_field_errors": ["Ya registraste ese antecedente con esa relación familiar para este paciente."]}
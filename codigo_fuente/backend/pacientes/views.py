@@ -1,10 +1,16 @@
 # backend/pacientes/views.py
+import hashlib
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Exists, OuterRef
+from django.utils.functional import cached_property
 from rest_framework import viewsets
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated, AllowAny, BasePermission, SAFE_METHODS
 from rest_framework.exceptions import NotFound
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from citas.models import Cita
 
 from .models import Paciente, Antecedente, PacienteAntecedente
 from .serializers import (
@@ -16,6 +22,9 @@ from usuarios.models import PACIENTE_ROLE_ID
 
 
 # --- Permiso: solo admin (id_rol=1) u odontólogo (id_rol=3) pueden modificar Antecedentes ---
+_ROLES_ESCRITURA = frozenset((1, 3))
+
+
 class IsAdminOrDentist(BasePermission):
     def has_permission(self, request, view):
         # Lecturas permitidas para todos
@@ -25,12 +34,43 @@ class IsAdminOrDentist(BasePermission):
         user = getattr(request, "user", None)
         if not user or not user.is_authenticated:
             return False
-        return getattr(user, "id_rol_id", None) in (1, 3)
+        return getattr(user, "id_rol_id", None) in _ROLES_ESCRITURA
+
+
+class _CachedCountPaginator(Paginator):
+    """Paginator que cachea el COUNT(*) unos segundos.
+
+    El COUNT sobre el DISTINCT de citas es la parte cara de paginar
+    de-odontologo; con TTL corto las páginas 2+ de la misma consulta
+    no lo repiten. La invalidación es por expiración, no por señales.
+    """
+
+    COUNT_TTL = 60  # segundos
+
+    @cached_property
+    def count(self):
+        key = "pac_pag_count:" + hashlib.md5(
+            str(self.object_list.query).encode()
+        ).hexdigest()
+        total = cache.get(key)
+        if total is None:
+            total = self.object_list.count()
+            cache.set(key, total, self.COUNT_TTL)
+        return total
+
+
+class PacientePagination(PageNumberPagination):
+    # Sin page_size por defecto: solo pagina si el cliente manda page_size,
+    # así las respuestas existentes (lista completa) no cambian.
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    django_paginator_class = _CachedCountPaginator
 
 
 class PacienteViewSet(viewsets.ModelViewSet):
     serializer_class = PacienteSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PacientePagination
 
     def get_queryset(self):
         user = self.request.user
@@ -55,13 +95,18 @@ class PacienteViewSet(viewsets.ModelViewSet):
         id_odo = request.query_params.get("id_odontologo")
         if not id_odo:
             return Response({"detail": "Falta id_odontologo"}, status=400)
-
-        pac_ids = (
-            Cita.objects.filter(id_odontologo=id_odo)
-            .values_list("id_paciente", flat=True)
+        try:
+            id_odo = int(id_odo)
+        except (TypeError, ValueError):
+            return Response({"detail": "id_odontologo inválido"}, status=400)
+
+        # JOIN + DISTINCT directo sobre Paciente vía la relación inversa de
+        # Cita, en lugar de una subconsulta IN con los ids de paciente
+        qs = (
+            Paciente.objects.filter(citas__id_odontologo_id=id_odo)
+            .select_related("id_usuario")
             .distinct()
         )
-        qs = Paciente.objects.filter(id_paciente__in=pac_ids).select_related("id_usuario")
 
         page = self.paginate_queryset(qs)
         if page is not None:
@@ -76,6 +121,15 @@ class AntecedenteViewSet(viewsets.ModelViewSet):
     queryset = Antecedente.objects.all()
     serializer_class = AntecedenteSerializer
 
+    def get_queryset(self):
+        # Anota en_uso con un EXISTS correlacionado para que el serializer
+        # no dispare una consulta por cada antecedente listado
+        return Antecedente.objects.annotate(
+            _en_uso=Exists(
+                PacienteAntecedente.objects.filter(id_antecedente=OuterRef("pk"))
+            )
+        )
+
     def get_permissions(self):
         if self.action in ["list", "retrieve"]:
             return [AllowAny()]
@@ -89,7 +143,17 @@ class PacienteAntecedenteViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        qs = PacienteAntecedente.objects.select_related('id_paciente', 'id_antecedente')
+        # El serializer solo usa los ids de las FKs y el nombre del
+        # antecedente: se une únicamente antecedente y se acotan columnas
+        qs = PacienteAntecedente.objects.select_related('id_antecedente').only(
+            'id_paciente_antecedente',
+            'id_paciente',
+            'id_antecedente',
+            'relacion_familiar',
+            'created_at',
+            'updated_at',
+            'id_antecedente__nombre',
+        )
 
         qp = self.request.query_params
 
@@ -118,15 +182,12 @@ class PacienteAntecedenteViewSet(viewsets.ModelViewSet):
 
     # validamos que el registro pertenezca a ese paciente.
     def get_object(self):
+        # La restricción por rol PACIENTE ya la aplica get_queryset
+        # (id_paciente__id_usuario_id=...), y super().get_object() consulta
+        # a través de ese queryset filtrado: un registro ajeno da 404 solo.
         obj = super().get_object()
         pid = self.request.query_params.get("id_paciente")
 
-        # Si es paciente, adicionalmente bloquea acceso a registros ajenos
-        user = self.request.user
-        if getattr(user, "id_rol_id", None) == PACIENTE_ROLE_ID:
-            if obj.id_paciente.id_usuario_id != getattr(user, "id_usuario", None):
-                raise NotFound("Registro no encontrado para el paciente autenticado.")
-
         if pid:
             try:
                 pid_int = int(pid)
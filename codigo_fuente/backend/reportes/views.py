@@ -1,16 +1,30 @@
 # reportes/views.py
+import hashlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import JsonResponse
 from django.utils.dateparse import parse_date
-from django.db.models import Count, Sum, Q
-from django.db.models.functions import TruncWeek, ExtractHour
+from django.db.models import CharField, Count, Func, Q, Sum, Value
+from django.db.models.functions import TruncWeek, ExtractHour, NullIf
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.response import Response
 from decimal import Decimal
 
 from citas.models import Cita, PagoCita
 
 
+# Tope del rango desde..hasta: las series diarias crecen linealmente con
+# el rango, así que se acota el trabajo de DB y el tamaño de la respuesta
+MAX_RANGO_DIAS = 366
+
+# TTL del payload completo de overview: el dashboard se refresca mucho y
+# tolera datos con unos segundos de atraso
+OVERVIEW_CACHE_TTL = 45
+
+
 class ReportesViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
@@ -19,16 +33,30 @@ class ReportesViewSet(viewsets.ViewSet):
         p = request.query_params
         desde = parse_date(p.get("desde"))
         hasta = parse_date(p.get("hasta"))
+        if desde and hasta and (hasta - desde).days > MAX_RANGO_DIAS:
+            return JsonResponse(
+                {"detail": f"El rango máximo permitido es de {MAX_RANGO_DIAS} días."},
+                status=400,
+            )
+
+        # Cache del payload completo por combinación de filtros: refrescos
+        # repetidos del dashboard no repiten el lote de ~15 agregados.
+        # Invalidación por TTL corto, igual que el count de paginación.
+        cache_key = "rep:ov:" + hashlib.md5(
+            urlencode(sorted(p.items())).encode()
+        ).hexdigest()
+        payload = cache.get(cache_key)
+        if payload is not None:
+            return JsonResponse(payload)
         odontologo = p.get("odontologo")
         consultorio = p.get("consultorio")
         estado = p.get("estado")
         especialidad = p.get("especialidad")
 
-        qs = Cita.objects.select_related(
-            "id_paciente__id_usuario",
-            "id_odontologo__id_usuario",
-            "id_consultorio",
-        )
+        # Solo se consumen agregados y values(): los JOIN que necesita
+        # top_pacientes los agrega values() por sí solo, así que no hace
+        # falta select_related en la consulta base.
+        qs = Cita.objects.all()
         if desde:
             qs = qs.filter(fecha__gte=desde)
         if hasta:
@@ -42,192 +70,227 @@ class ReportesViewSet(viewsets.ViewSet):
         if especialidad:
             qs = qs.filter(id_odontologo__especialidades__id_especialidad_id=especialidad)
 
-        # ---------- KPIs ----------
-        total = qs.count()
-        realizadas = qs.filter(estado="realizada").count()
-        confirmadas = qs.filter(estado="confirmada").count()
-        canceladas = qs.filter(estado="cancelada").count()
-        denom = realizadas + canceladas
-        asistencia_pct = float(realizadas * 100.0 / denom) if denom else 0.0
-
-        kpis = {
-            "citas_totales": total,
-            "realizadas": realizadas,
-            "confirmadas": confirmadas,
-            "canceladas": canceladas,
-            "asistencia_pct": asistencia_pct,
-        }
+        # Todo el lote de agregados corre en una sola transacción de
+        # solo lectura: snapshot consistente entre KPIs y series, y
+        # statement_timeout acota cualquier consulta patológica.
+        with transaction.atomic():
+            with connection.cursor() as cur:
+                cur.execute("SET LOCAL transaction_read_only = on")
+                cur.execute("SET LOCAL statement_timeout = '10s'")
 
-        # ---------- Series ----------
-        por_dia = [
-            {"fecha": r["fecha"].isoformat(), "total": r["total"]}
-            for r in qs.values("fecha").annotate(total=Count("id_cita")).order_by("fecha")
-        ]
-
-        por_semana_raw = (
-            qs.annotate(sem=TruncWeek("fecha"))
-              .values("sem", "estado")
-              .annotate(total=Count("id_cita"))
-              .order_by("sem")
-        )
-        sem_map = {}
-        for r in por_semana_raw:
-            key = r["sem"].isoformat() if r["sem"] else "N/A"
-            sem_map.setdefault(key, {"semana": key, "pendiente": 0, "confirmada": 0, "cancelada": 0, "realizada": 0})
-            sem_map[key][r["estado"]] = r["total"]
-        por_semana_estado = list(sem_map.values())
-
-        por_especialidad = [
-            {
-                "especialidad": r["id_odontologo__especialidades__id_especialidad__nombre"] or "Sin especialidad",
-                "total": r["total"],
-            }
-            for r in (
-                qs.values("id_odontologo__especialidades__id_especialidad__nombre")
-                  .annotate(total=Count("id_cita"))
-                  .order_by("-total")
-            )
-        ]
-
-        por_hora = [
-            {"hora": f"{int(r['hh']):02d}:00", "total": r["total"]}
-            for r in (
-                qs.annotate(hh=ExtractHour("hora"))
-                  .values("hh")
-                  .annotate(total=Count("id_cita"))
-                  .order_by("hh")
+            # ---------- KPIs ----------
+            # Un solo aggregate con COUNT(...) FILTER (...) en lugar de un count()
+            # por estado: una sola pasada sobre las citas filtradas.
+            conteos = qs.aggregate(
+                total=Count("id_cita"),
+                realizadas=Count("id_cita", filter=Q(estado="realizada")),
+                confirmadas=Count("id_cita", filter=Q(estado="confirmada")),
+                canceladas=Count("id_cita", filter=Q(estado="cancelada")),
             )
-            if r["hh"] is not None
-        ]
-
-        # ---------- Tabla: Top pacientes ----------
-        top_pac_q = (
-            qs.values(
-                "id_paciente__id_usuario__cedula",
-                "id_paciente__id_usuario__primer_nombre",
-                "id_paciente__id_usuario__segundo_nombre",
-                "id_paciente__id_usuario__primer_apellido",
-                "id_paciente__id_usuario__segundo_apellido",
-            )
-            .annotate(citas=Count("id_cita"))
-            .order_by("-citas")[:10]
-        )
-
-        def full_name(r):
-            parts = [
-                r.get("id_paciente__id_usuario__primer_nombre"),
-                r.get("id_paciente__id_usuario__segundo_nombre"),
-                r.get("id_paciente__id_usuario__primer_apellido"),
-                r.get("id_paciente__id_usuario__segundo_apellido"),
-            ]
-            return " ".join([p for p in parts if p]) or "—"
+            total = conteos["total"]
+            realizadas = conteos["realizadas"]
+            confirmadas = conteos["confirmadas"]
+            canceladas = conteos["canceladas"]
+            denom = realizadas + canceladas
+            asistencia_pct = float(realizadas * 100.0 / denom) if denom else 0.0
 
-        top_pacientes = [
-            {
-                "paciente": full_name(r),
-                "cedula": r.get("id_paciente__id_usuario__cedula") or "",
-                "citas": r["citas"],
+            kpis = {
+                "citas_totales": total,
+                "realizadas": realizadas,
+                "confirmadas": confirmadas,
+                "canceladas": canceladas,
+                "asistencia_pct": asistencia_pct,
             }
-            for r in top_pac_q
-        ]
 
-        # ---------- KPIs de Pagos ----------
-        # Filtrar pagos según las mismas citas del reporte
-        citas_ids = qs.values_list('id_cita', flat=True)
-        pagos_qs = PagoCita.objects.filter(id_cita_id__in=citas_ids)
-        
-        # Total recaudado (solo pagos en estado 'pagado')
-        total_recaudado = pagos_qs.filter(estado_pago='pagado').aggregate(
-            total=Sum('monto')
-        )['total'] or Decimal('0.00')
+            # ---------- Series ----------
+            por_dia = [
+                {"fecha": r["fecha"].isoformat(), "total": r["total"]}
+                for r in qs.values("fecha").annotate(total=Count("id_cita")).order_by("fecha")
+            ]
+
+            # Pivot en SQL con agregados condicionales: una fila por semana,
+            # sin armar el dict intermedio por (semana, estado) en Python
+            por_semana_estado = [
+                {
+                    "semana": r["sem"].isoformat() if r["sem"] else "N/A",
+                    "pendiente": r["pendiente"],
+                    "confirmada": r["confirmada"],
+                    "cancelada": r["cancelada"],
+                    "realizada": r["realizada"],
+                }
+                for r in (
+                    qs.annotate(sem=TruncWeek("fecha"))
+                      .values("sem")
+                      .annotate(
+                          pendiente=Count("id_cita", filter=Q(estado="pendiente")),
+                          confirmada=Count("id_cita", filter=Q(estado="confirmada")),
+                          cancelada=Count("id_cita", filter=Q(estado="cancelada")),
+                          realizada=Count("id_cita", filter=Q(estado="realizada")),
+                      )
+                      .order_by("sem")
+                )
+            ]
+
+            por_especialidad = [
+                {
+                    "especialidad": r["id_odontologo__especialidades__id_especialidad__nombre"] or "Sin especialidad",
+                    "total": r["total"],
+                }
+                for r in (
+                    qs.values("id_odontologo__especialidades__id_especialidad__nombre")
+                      .annotate(total=Count("id_cita"))
+                      .order_by("-total")
+                )
+            ]
+
+            por_hora = [
+                {"hora": f"{int(r['hh']):02d}:00", "total": r["total"]}
+                for r in (
+                    qs.annotate(hh=ExtractHour("hora"))
+                      .values("hh")
+                      .annotate(total=Count("id_cita"))
+                      .order_by("hh")
+                )
+                if r["hh"] is not None
+            ]
+
+            # ---------- Tabla: Top pacientes ----------
+            # CONCAT_WS arma el nombre completo en SQL (omite NULLs, y NULLIF
+            # convierte los '' en NULL), en vez de list+filter+join por fila
+            top_pac_q = (
+                qs.values("id_paciente__id_usuario__cedula")
+                .annotate(
+                    citas=Count("id_cita"),
+                    full_name=Func(
+                        Value(" "),
+                        NullIf("id_paciente__id_usuario__primer_nombre", Value("")),
+                        NullIf("id_paciente__id_usuario__segundo_nombre", Value("")),
+                        NullIf("id_paciente__id_usuario__primer_apellido", Value("")),
+                        NullIf("id_paciente__id_usuario__segundo_apellido", Value("")),
+                        function="CONCAT_WS",
+                        output_field=CharField(),
+                    ),
+                )
+                .order_by("-citas")[:10]
+            )
+
+            top_pacientes = [
+                {
+                    "paciente": r["full_name"] or "—",
+                    "cedula": r.get("id_paciente__id_usuario__cedula") or "",
+                    "citas": r["citas"],
+                }
+                for r in top_pac_q
+            ]
+
+            # ---------- KPIs de Pagos ----------
+            # Filtrar pagos según las mismas citas del reporte: subconsulta
+            # estrecha (solo id_cita) que el planner puede convertir en semi-join
+            pagos_qs = PagoCita.objects.filter(id_cita_id__in=qs.values('id_cita'))
         
-        # Reembolsos
-        reembolsos_data = pagos_qs.filter(estado_pago='reembolsado').aggregate(
-            total=Sum('monto'),
-            cantidad=Count('id_pago_cita')
-        )
-        total_reembolsado = reembolsos_data['total'] or Decimal('0.00')
-        cantidad_reembolsos = reembolsos_data['cantidad'] or 0
+            # Recaudado, reembolsos y pagos completados en una sola pasada
+            # sobre pagos_qs usando agregados condicionales
+            pagos_data = pagos_qs.aggregate(
+                recaudado=Sum('monto', filter=Q(estado_pago='pagado')),
+                reembolsado=Sum('monto', filter=Q(estado_pago='reembolsado')),
+                n_reembolsos=Count('id_pago_cita', filter=Q(estado_pago='reembolsado')),
+                n_pagados=Count('id_pago_cita', filter=Q(estado_pago='pagado')),
+            )
+            total_recaudado = pagos_data['recaudado'] or Decimal('0.00')
+            total_reembolsado = pagos_data['reembolsado'] or Decimal('0.00')
+            cantidad_reembolsos = pagos_data['n_reembolsos'] or 0
+
+            # Pagos completados vs pendientes
+            pagos_completados = pagos_data['n_pagados'] or 0
+            citas_realizadas = realizadas
+            pagos_pendientes = max(0, citas_realizadas - pagos_completados)
         
-        # Pagos completados vs pendientes
-        pagos_completados = pagos_qs.filter(estado_pago='pagado').count()
-        citas_realizadas = qs.filter(estado='realizada').count()
-        pagos_pendientes = max(0, citas_realizadas - pagos_completados)
+            # Tasa de pago (% de citas realizadas que tienen pago)
+            tasa_pago = float(pagos_completados * 100.0 / citas_realizadas) if citas_realizadas > 0 else 0.0
         
-        # Tasa de pago (% de citas realizadas que tienen pago)
-        tasa_pago = float(pagos_completados * 100.0 / citas_realizadas) if citas_realizadas > 0 else 0.0
+            # Ingreso neto (recaudado - reembolsado)
+            ingreso_neto = total_recaudado - total_reembolsado
         
-        # Ingreso neto (recaudado - reembolsado)
-        ingreso_neto = total_recaudado - total_reembolsado
+            kpis_pagos = {
+                "total_recaudado": float(total_recaudado),
+                "total_reembolsado": float(total_reembolsado),
+                "ingreso_neto": float(ingreso_neto),
+                "pagos_completados": pagos_completados,
+                "pagos_pendientes": pagos_pendientes,
+                "cantidad_reembolsos": cantidad_reembolsos,
+                "tasa_pago": tasa_pago,
+            }
         
-        kpis_pagos = {
-            "total_recaudado": float(total_recaudado),
-            "total_reembolsado": float(total_reembolsado),
-            "ingreso_neto": float(ingreso_neto),
-            "pagos_completados": pagos_completados,
-            "pagos_pendientes": pagos_pendientes,
-            "cantidad_reembolsos": cantidad_reembolsos,
-            "tasa_pago": tasa_pago,
-        }
+            # ---------- Series de Pagos ----------
+            # Ingresos por día
+            ingresos_por_dia = [
+                {
+                    "fecha": r["id_cita__fecha"].isoformat(),
+                    "monto": float(r["total"]) if r["total"] else 0.0
+                }
+                for r in pagos_qs.filter(estado_pago='pagado').values("id_cita__fecha")
+                    .annotate(total=Sum('monto'))
+                    .order_by("id_cita__fecha")
+            ]
         
-        # ---------- Series de Pagos ----------
-        # Ingresos por día
-        ingresos_por_dia = [
-            {
-                "fecha": r["id_cita__fecha"].isoformat(),
-                "monto": float(r["total"]) if r["total"] else 0.0
-            }
-            for r in pagos_qs.filter(estado_pago='pagado').values("id_cita__fecha")
-                .annotate(total=Sum('monto'))
-                .order_by("id_cita__fecha")
-        ]
+            # Distribución por método de pago
+            por_metodo_pago = [
+                {
+                    "metodo": r["metodo_pago"].capitalize(),
+                    "total": r["count"],
+                    "monto": float(r["monto_total"]) if r["monto_total"] else 0.0
+                }
+                for r in pagos_qs.filter(estado_pago='pagado').values("metodo_pago")
+                    .annotate(
+                        count=Count('id_pago_cita'),
+                        monto_total=Sum('monto')
+                    )
+                    .order_by("-monto_total")
+            ]
         
-        # Distribución por método de pago
-        por_metodo_pago = [
-            {
-                "metodo": r["metodo_pago"].capitalize(),
-                "total": r["count"],
-                "monto": float(r["monto_total"]) if r["monto_total"] else 0.0
-            }
-            for r in pagos_qs.filter(estado_pago='pagado').values("metodo_pago")
-                .annotate(
-                    count=Count('id_pago_cita'),
-                    monto_total=Sum('monto')
+            # Comparación citas realizadas vs pagadas (por día)
+            # Dos consultas agrupadas por fecha en lugar de un count() por día
+            citas_realizadas_por_dia = dict(
+                qs.filter(estado='realizada')
+                  .values_list('fecha')
+                  .annotate(total=Count('id_cita'))
+                  .order_by('fecha')
+            )
+            pagadas_por_dia = dict(
+                pagos_qs.filter(
+                    estado_pago='pagado',
+                    id_cita__fecha__in=citas_realizadas_por_dia,
                 )
-                .order_by("-monto_total")
-        ]
-        
-        # Comparación citas realizadas vs pagadas (por día)
-        citas_vs_pagos = []
-        for dia in qs.filter(estado='realizada').values('fecha').annotate(
-            citas_realizadas=Count('id_cita')
-        ).order_by('fecha'):
-            fecha_iso = dia['fecha'].isoformat()
-            pagadas = pagos_qs.filter(
-                id_cita__fecha=dia['fecha'],
-                estado_pago='pagado'
-            ).count()
-            citas_vs_pagos.append({
-                "fecha": fecha_iso,
-                "citas_realizadas": dia['citas_realizadas'],
-                "pagadas": pagadas,
-                "pendientes": dia['citas_realizadas'] - pagadas
-            })
+                .values_list('id_cita__fecha')
+                .annotate(total=Count('id_pago_cita'))
+            )
+            citas_vs_pagos = []
+            for fecha, n_citas in sorted(citas_realizadas_por_dia.items()):
+                pagadas = pagadas_por_dia.get(fecha, 0)
+                citas_vs_pagos.append({
+                    "fecha": fecha.isoformat(),
+                    "citas_realizadas": n_citas,
+                    "pagadas": pagadas,
+                    "pendientes": n_citas - pagadas
+                })
         
-        # Ingresos por semana
-        ingresos_por_semana = [
-            {
-                "semana": r["semana"].isoformat() if r["semana"] else "N/A",
-                "monto": float(r["total"]) if r["total"] else 0.0
-            }
-            for r in pagos_qs.filter(estado_pago='pagado')
-                .annotate(semana=TruncWeek('id_cita__fecha'))
-                .values("semana")
-                .annotate(total=Sum('monto'))
-                .order_by("semana")
-        ]
-
-        return Response({
+            # Ingresos por semana
+            ingresos_por_semana = [
+                {
+                    "semana": r["semana"].isoformat() if r["semana"] else "N/A",
+                    "monto": float(r["total"]) if r["total"] else 0.0
+                }
+                for r in pagos_qs.filter(estado_pago='pagado')
+                    .annotate(semana=TruncWeek('id_cita__fecha'))
+                    .values("semana")
+                    .annotate(total=Sum('monto'))
+                    .order_by("semana")
+            ]
+
+        # El payload ya son dicts/listas planas (fechas en isoformat,
+        # montos en float), así que se responde con JsonResponse directo
+        # y se evita la negociación de contenido y el renderer de DRF
+        payload = {
             "kpis": kpis,
             "kpis_pagos": kpis_pagos,
             "series": {
@@ -243,4 +306,6 @@ class ReportesViewSet(viewsets.ViewSet):
             "tablas": {
                 "top_pacientes": top_pacientes,
             }
-        })
+        }
+        cache.set(cache_key, payload, OVERVIEW_CACHE_TTL)
+        return JsonResponse(payload)
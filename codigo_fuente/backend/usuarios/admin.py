@@ -8,6 +8,14 @@ class UsuarioAdmin(UserAdmin):
     list_filter = ('is_staff', 'is_active')
     search_fields = ('email',)
     ordering = ('email',)
+    # Evita el COUNT(*) sin filtros en cada carga del changelist y trae el
+    # rol en el mismo JOIN si algún display/filter lo llega a referenciar
+    show_full_result_count = False
+    list_select_related = ('id_rol',)
+
+    def get_queryset(self, request):
+        # Trae el rol en el mismo JOIN para no consultar Rol por fila
+        return super().get_queryset(request).select_related('id_rol')
 
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
@@ -7,9 +7,15 @@ Incluye protección contra ataques de fuerza bruta con bloqueo escalonado:
 - 11-15 intentos: Bloqueo 1 hora
 - 16-20 intentos: Desactivación automática de cuenta
 """
+from bisect import bisect_right
+
 from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.db.models import F
 from django.utils import timezone
 from datetime import timedelta
+from usuarios import intentos_buffer
 from usuarios.models import (
     Usuario, IntentosLogin,
     MAX_INTENTOS_ANTES_BLOQUEO_1, MAX_INTENTOS_ANTES_BLOQUEO_2,
@@ -17,12 +23,71 @@ from usuarios.models import (
     TIEMPO_BLOQUEO_1, TIEMPO_BLOQUEO_2, TIEMPO_BLOQUEO_3
 )
 
+# Espejo del bloqueo temporal en cache (Redis en despliegue): mientras la
+# cuenta esté bloqueada, los reintentos del atacante se rechazan con un solo
+# acceso en memoria en vez de recargar la fila de usuario en cada intento.
+# La BD sigue siendo la fuente de verdad (el bloqueo sobrevive reinicios).
+_LOCK_KEY = "login:lock:{}"
+
+# Cuentas desactivadas: se recuerda la decisión 60s para que el martilleo
+# sobre una cuenta muerta tampoco recargue la fila en cada intento. El TTL
+# corto acota el atraso si un admin reactiva la cuenta.
+_INACTIVA_KEY = "login:inactiva:{}"
+_INACTIVA_TTL = 60
+
+# Hash señuelo calculado una sola vez: cuando la cédula no existe se verifica
+# la contraseña contra este hash para igualar el tiempo de respuesta con el
+# camino real (check_password), sin regenerar sal ni instanciar un Usuario
+_DUMMY_HASH = make_password('x' * 32)
+
+# Escalera de umbrales ordenada: bisect devuelve el nivel de bloqueo en una
+# sola búsqueda en vez de la cascada de comparaciones contra cada constante.
+# Nivel 0 = sin bloqueo, 1-3 = bloqueo temporal, 4 = desactivar cuenta.
+_UMBRALES = (
+    MAX_INTENTOS_ANTES_BLOQUEO_1,
+    MAX_INTENTOS_ANTES_BLOQUEO_2,
+    MAX_INTENTOS_ANTES_BLOQUEO_3,
+    MAX_INTENTOS_ANTES_DESACTIVAR,
+)
+# Duraciones de bloqueo ya convertidas a timedelta una sola vez, indexadas
+# por nivel (el indice 0 no se usa: nivel 0 = sin bloqueo)
+_TD_BLOQUEO = (
+    None,
+    timedelta(minutes=TIEMPO_BLOQUEO_1),
+    timedelta(minutes=TIEMPO_BLOQUEO_2),
+    timedelta(minutes=TIEMPO_BLOQUEO_3),
+)
+
+# Límite por IP: el esquema por usuario no frena a un atacante que rota
+# cédulas (credential stuffing), así que además se cuenta el total de
+# fallos por IP en una ventana de 5 minutos y se rechaza al excederla
+# antes de tocar la BD.
+_IP_FALLOS_KEY = "login:ipfallos:{}"
+_IP_VENTANA = 300        # segundos
+_IP_MAX_FALLOS = 50      # fallos permitidos por IP por ventana
+
+
+def _registrar_fallo_ip(ip_address):
+    """Suma un fallo al contador de la IP (ventana fija en cache)."""
+    key = _IP_FALLOS_KEY.format(ip_address)
+    if not cache.add(key, 1, _IP_VENTANA):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # La clave expiró entre el add y el incr: reabrir ventana
+            cache.add(key, 1, _IP_VENTANA)
+
+
+def _ip_excedio_limite(ip_address):
+    return (cache.get(_IP_FALLOS_KEY.format(ip_address)) or 0) >= _IP_MAX_FALLOS
+
 
 def obtenerIpCliente(request):
     # Obtiene la IP real del cliente considerando proxies/balanceadores
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
     if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0].strip()
+        # partition evita construir la lista completa de saltos del proxy
+        ip = x_forwarded_for.partition(',')[0].strip()
     else:
         ip = request.META.get('REMOTE_ADDR', '0.0.0.0')
     return ip
@@ -60,81 +125,131 @@ class CedulaAuthenticationBackend(ModelBackend):
         Returns:
             Usuario autenticado o None si falla
         """
+        # authenticate() recibe la cédula bajo el USERNAME_FIELD del modelo
+        # cuando viene de simplejwt (/api/v1/token/); sin aceptarla aquí el
+        # backend devolvía None y el login de la API caía al ModelBackend,
+        # saltándose el contador de intentos y el corte por IP
+        if username is None:
+            username = kwargs.get('cedula')
         if username is None or password is None:
             return None
         
         ip_address = obtenerIpCliente(request) if request else '0.0.0.0'
-        
+        ahora = timezone.now()  # una sola lectura del reloj por intento
+
+        # Corte por IP: demasiados fallos acumulados desde esta dirección
+        if _ip_excedio_limite(ip_address):
+            intentos_buffer.registrar(IntentosLogin(
+                id_usuario=None,
+                cedula_intentada=username,
+                ip_address=ip_address,
+                exitoso=False
+            ))
+            return None
+
+        # Fast path: bloqueo o cuenta inactiva espejados en cache →
+        # rechazar sin tocar la BD (solo queda el registro de auditoría,
+        # sin FK porque no se carga la fila de usuario)
+        if cache.get(_LOCK_KEY.format(username)) or cache.get(_INACTIVA_KEY.format(username)):
+            _registrar_fallo_ip(ip_address)
+            intentos_buffer.registrar(IntentosLogin(
+                id_usuario=None,
+                cedula_intentada=username,
+                ip_address=ip_address,
+                exitoso=False
+            ))
+            return None
+
         try:
-            # Buscar SOLO por cédula
-            usuario = Usuario.objects.get(cedula=username)
+            # Buscar SOLO por cédula (con el rol en el mismo JOIN: save()
+            # y los consumidores del usuario autenticado leen id_rol)
+            usuario = Usuario.objects.select_related('id_rol').get(cedula=username)
             
             # Si la cuenta está desactivada, rechazar inmediatamente (no incrementar más)
             if not usuario.is_active:
+                _registrar_fallo_ip(ip_address)
+                cache.set(_INACTIVA_KEY.format(username), True, _INACTIVA_TTL)
                 # Registrar intento pero NO incrementar contador
-                IntentosLogin.objects.create(
+                intentos_buffer.registrar(IntentosLogin(
                     id_usuario=usuario,
                     cedula_intentada=username,
                     ip_address=ip_address,
                     exitoso=False
-                )
+                ))
                 return None
             
             # Verificar si está bloqueado temporalmente
-            if usuario.bloqueado_hasta and usuario.bloqueado_hasta > timezone.now():
+            if usuario.bloqueado_hasta and usuario.bloqueado_hasta > ahora:
+                _registrar_fallo_ip(ip_address)
+                # Repoblar el espejo en cache por lo que reste del bloqueo
+                restante = (usuario.bloqueado_hasta - ahora).total_seconds()
+                if restante > 0:
+                    cache.set(_LOCK_KEY.format(username), True, restante)
                 # Registrar intento durante bloqueo
-                IntentosLogin.objects.create(
+                intentos_buffer.registrar(IntentosLogin(
                     id_usuario=usuario,
                     cedula_intentada=username,
                     ip_address=ip_address,
                     exitoso=False
-                )
+                ))
                 return None
             
             # Si el bloqueo ya expiró, resetear
-            if usuario.bloqueado_hasta and usuario.bloqueado_hasta <= timezone.now():
+            if usuario.bloqueado_hasta and usuario.bloqueado_hasta <= ahora:
+                Usuario.objects.filter(pk=usuario.pk).update(
+                    bloqueado_hasta=None,
+                    intentos_fallidos=0,
+                )
                 usuario.bloqueado_hasta = None
                 usuario.intentos_fallidos = 0
-                usuario.save(update_fields=['bloqueado_hasta', 'intentos_fallidos'])
             
             # Validar contraseña
             if usuario.check_password(password):
                 # Login exitoso: resetear intentos fallidos
                 if usuario.intentos_fallidos > 0 or usuario.ultimo_intento_fallido:
+                    # UPDATE directo en vez de save(): mismo efecto sin
+                    # señales ni la lógica completa del save() del modelo
+                    Usuario.objects.filter(pk=usuario.pk).update(
+                        intentos_fallidos=0,
+                        ultimo_intento_fallido=None,
+                        bloqueado_hasta=None,
+                    )
                     usuario.intentos_fallidos = 0
                     usuario.ultimo_intento_fallido = None
                     usuario.bloqueado_hasta = None
-                    usuario.save(update_fields=['intentos_fallidos', 'ultimo_intento_fallido', 'bloqueado_hasta'])
+                    cache.delete(_LOCK_KEY.format(username))
                 
                 # Registrar intento exitoso
-                IntentosLogin.objects.create(
+                intentos_buffer.registrar(IntentosLogin(
                     id_usuario=usuario,
                     cedula_intentada=username,
                     ip_address=ip_address,
                     exitoso=True
-                )
+                ))
                 
                 return usuario
             else:
                 # Contraseña incorrecta: incrementar contador
-                self._registrarIntentoFallido(usuario, username, ip_address)
+                self._registrarIntentoFallido(usuario, username, ip_address, ahora)
                 return None
                 
         except Usuario.DoesNotExist:
+            _registrar_fallo_ip(ip_address)
             # Usuario no existe: registrar intento sin FK
-            IntentosLogin.objects.create(
+            intentos_buffer.registrar(IntentosLogin(
                 id_usuario=None,
                 cedula_intentada=username,
                 ip_address=ip_address,
                 exitoso=False
-            )
-            # Ejecutar hash de contraseña para evitar timing attacks
-            Usuario().set_password(password)
+            ))
+            # Verificación señuelo para evitar timing attacks: mismo camino
+            # (check_password) y mismo costo de KDF que un login real
+            check_password(password, _DUMMY_HASH)
             return None
         
         return None
     
-    def _registrarIntentoFallido(self, usuario, cedula, ip_address):
+    def _registrarIntentoFallido(self, usuario, cedula, ip_address, ahora):
         """
         Registra intento fallido, incrementa contador y aplica bloqueo escalonado.
         
@@ -148,35 +263,47 @@ class CedulaAuthenticationBackend(ModelBackend):
             usuario: Instancia del Usuario
             cedula: Cédula intentada
             ip_address: IP del cliente
+            ahora: timestamp ya tomado por authenticate()
         """
         # Registrar en historial
-        IntentosLogin.objects.create(
+        _registrar_fallo_ip(ip_address)
+        intentos_buffer.registrar(IntentosLogin(
             id_usuario=usuario,
             cedula_intentada=cedula,
             ip_address=ip_address,
             exitoso=False
+        ))
+
+        # Incrementar contador: la decisión de umbral usa el valor local,
+        # pero el incremento va como F() para ser atómico bajo concurrencia
+        intentos = usuario.intentos_fallidos + 1
+        bloqueado_hasta = None
+        is_active = usuario.is_active
+
+        # Sistema de bloqueo escalonado resuelto por bisect sobre la
+        # escalera de umbrales
+        nivel = bisect_right(_UMBRALES, intentos)
+        if nivel >= len(_UMBRALES):
+            # 20+ intentos: DESACTIVAR CUENTA (ya no necesita bloqueo temporal)
+            is_active = False
+        elif nivel > 0:
+            bloqueado_hasta = ahora + _TD_BLOQUEO[nivel]
+
+        # UPDATE directo: sin señales, sin re-ejecutar el save() del modelo
+        # (normalización de celular, flags de rol, etc.) en cada fallo
+        Usuario.objects.filter(pk=usuario.pk).update(
+            intentos_fallidos=F('intentos_fallidos') + 1,
+            ultimo_intento_fallido=ahora,
+            bloqueado_hasta=bloqueado_hasta,
+            is_active=is_active,
         )
-        
-        # Incrementar contador
-        usuario.intentos_fallidos += 1
-        usuario.ultimo_intento_fallido = timezone.now()
-        
-        # Sistema de bloqueo escalonado
-        if usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_DESACTIVAR:
-            # 20+ intentos: DESACTIVAR CUENTA
-            usuario.is_active = False
-            usuario.bloqueado_hasta = None  # Ya no necesita bloqueo temporal
-        elif usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_BLOQUEO_3:
-            # 15-19 intentos: Bloqueo de 1 hora
-            usuario.bloqueado_hasta = timezone.now() + timedelta(minutes=TIEMPO_BLOQUEO_3)
-        elif usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_BLOQUEO_2:
-            # 10-14 intentos: Bloqueo de 30 minutos
-            usuario.bloqueado_hasta = timezone.now() + timedelta(minutes=TIEMPO_BLOQUEO_2)
-        elif usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_BLOQUEO_1:
-            # 5-9 intentos: Bloqueo de 15 minutos
-            usuario.bloqueado_hasta = timezone.now() + timedelta(minutes=TIEMPO_BLOQUEO_1)
-        
-        usuario.save(update_fields=['intentos_fallidos', 'ultimo_intento_fallido', 'bloqueado_hasta', 'is_active'])
+
+        # Espejar el bloqueo recién aplicado para que los siguientes
+        # intentos se corten en cache sin recargar al usuario
+        if bloqueado_hasta:
+            restante = (bloqueado_hasta - ahora).total_seconds()
+            if restante > 0:
+                cache.set(_LOCK_KEY.format(cedula), True, restante)
     
     def get_user(self, user_id):
         """
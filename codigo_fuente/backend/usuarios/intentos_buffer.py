@@ -0,0 +1,64 @@
+# usuarios/intentos_buffer.py
+"""
+Buffer de escrituras de IntentosLogin.
+
+Cada intento de login insertaba su fila de auditoría con un INSERT
+síncrono propio, duplicando los round-trips a la BD del camino de
+autenticación. Aquí los intentos se encolan y se vuelcan en lote con
+bulk_create, amortizando el costo de commit por fila bajo tráfico de
+ataque.
+
+El lote se vuelca cuando alcanza _BATCH_SIZE o cuando el intento más
+antiguo lleva más de _MAX_ESPERA segundos encolado (se evalúa en cada
+registro nuevo); al terminar el proceso se vuelca lo pendiente vía
+atexit. La auditoría puede llegar con un par de segundos de atraso,
+lo cual es aceptable para este registro.
+"""
+import atexit
+import threading
+import time
+from collections import deque
+
+_BATCH_SIZE = 50    # tamaño de lote que dispara el volcado
+_MAX_ESPERA = 2.0   # segundos máximos que un intento espera en el buffer
+
+_buffer = deque()
+_lock = threading.Lock()
+_primer_enqueue = None
+
+
+def registrar(intento):
+    """Encola una instancia de IntentosLogin (sin guardar) para volcado en lote."""
+    global _primer_enqueue
+    ahora = time.monotonic()
+    lote = None
+    with _lock:
+        _buffer.append(intento)
+        if _primer_enqueue is None:
+            _primer_enqueue = ahora
+        if len(_buffer) >= _BATCH_SIZE or (ahora - _primer_enqueue) >= _MAX_ESPERA:
+            lote = list(_buffer)
+            _buffer.clear()
+            _primer_enqueue = None
+    if lote:
+        _volcar(lote)
+
+
+def vaciar():
+    """Vuelca inmediatamente lo pendiente (atexit, o para forzar en pruebas)."""
+    global _primer_enqueue
+    with _lock:
+        lote = list(_buffer)
+        _buffer.clear()
+        _primer_enqueue = None
+    if lote:
+        _volcar(lote)
+
+
+def _volcar(lote):
+    # Import diferido para no crear ciclos con usuarios.models
+    from usuarios.models import IntentosLogin
+    IntentosLogin.objects.bulk_create(lote, batch_size=500)
+
+
+atexit.register(vaciar)
@@ -1,11 +1,15 @@
 # Comando para normalizar todos los números de celular existentes en la BD al formato E.164.
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
 
 from usuarios.models import Usuario
 from pacientes.models import Paciente
 from usuarios.utils import normalizar_celular_ecuador
 
+BATCH_SIZE = 1000  # filas por bulk_update
+
 
 class Command(BaseCommand):
     help = "Normaliza todos los números de celular en la BD al formato E.164 (+593...)"
@@ -32,8 +36,20 @@ class Command(BaseCommand):
         usuarios_actualizados = 0
         usuarios_sin_cambios = 0
         usuarios_sin_celular = 0
-        
-        for usuario in Usuario.objects.all():
+        ahora = timezone.now()
+
+        # Acumular los cambios y escribirlos por lotes con bulk_update:
+        # un UPDATE por lote en vez de un UPDATE+commit por fila
+        usuarios_por_actualizar = []
+        usuarios_qs = (
+            Usuario.objects
+            # select_related(None): sin él, el JOIN a rol por defecto del
+            # manager choca con el only() que difiere id_rol (FieldError)
+            .select_related(None)
+            .only('id_usuario', 'celular', 'primer_nombre', 'primer_apellido', 'updated_at')
+            .iterator(chunk_size=2000)
+        )
+        for usuario in usuarios_qs:
             if not usuario.celular:
                 usuarios_sin_celular += 1
                 continue
@@ -49,11 +65,18 @@ class Command(BaseCommand):
                 
                 if not dry_run:
                     usuario.celular = celular_normalizado
-                    usuario.save(update_fields=['celular', 'updated_at'])
+                    usuario.updated_at = ahora  # bulk_update no dispara auto_now
+                    usuarios_por_actualizar.append(usuario)
                 
                 usuarios_actualizados += 1
             else:
                 usuarios_sin_cambios += 1
+
+        if usuarios_por_actualizar:
+            with transaction.atomic():
+                Usuario.objects.bulk_update(
+                    usuarios_por_actualizar, ['celular', 'updated_at'], batch_size=BATCH_SIZE
+                )
         
         self.stdout.write("\n" + "=" * 70)
         self.stdout.write("📱 NORMALIZANDO CELULARES DE CONTACTOS DE EMERGENCIA")
@@ -61,8 +84,14 @@ class Command(BaseCommand):
         
         pacientes_actualizados = 0
         pacientes_sin_cambios = 0
-        
-        for paciente in Paciente.objects.all():
+
+        pacientes_por_actualizar = []
+        pacientes_qs = (
+            Paciente.objects
+            .only('id_paciente', 'contacto_emergencia_cel', 'contacto_emergencia_nom', 'updated_at')
+            .iterator(chunk_size=2000)
+        )
+        for paciente in pacientes_qs:
             if not paciente.contacto_emergencia_cel:
                 continue
             
@@ -77,11 +106,20 @@ class Command(BaseCommand):
                 
                 if not dry_run:
                     paciente.contacto_emergencia_cel = celular_normalizado
-                    paciente.save(update_fields=['contacto_emergencia_cel', 'updated_at'])
+                    paciente.updated_at = ahora
+                    pacientes_por_actualizar.append(paciente)
                 
                 pacientes_actualizados += 1
             else:
                 pacientes_sin_cambios += 1
+
+        if pacientes_por_actualizar:
+            with transaction.atomic():
+                Paciente.objects.bulk_update(
+                    pacientes_por_actualizar,
+                    ['contacto_emergencia_cel', 'updated_at'],
+                    batch_size=BATCH_SIZE,
+                )
         
         # Resumen
         self.stdout.write("\n" + "=" * 70)
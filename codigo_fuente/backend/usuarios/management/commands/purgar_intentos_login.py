@@ -0,0 +1,58 @@
+# Comando para purgar registros antiguos de intentos_login.
+#
+# La tabla crece con cada intento de login (exitoso o no) y sin retención
+# los índices por cédula/IP se degradan con los millones de filas. Se borra
+# por lotes acotados para no tomar un lock largo ni inflar el WAL con un
+# DELETE masivo único. Pensado para ejecutarse desde un cron diario.
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datetime import timedelta
+
+from usuarios.models import IntentosLogin
+
+DIAS_RETENCION = 90    # historial que se conserva por defecto
+BATCH_SIZE = 5000      # filas borradas por transacción
+
+
+class Command(BaseCommand):
+    help = "Elimina registros de intentos de login con más de N días de antigüedad"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=DIAS_RETENCION,
+            help=f'Días de historial a conservar (por defecto {DIAS_RETENCION})',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Muestra cuántas filas se borrarían sin eliminarlas',
+        )
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(days=options['dias'])
+        antiguos = IntentosLogin.objects.filter(created_at__lt=limite)
+
+        if options['dry_run']:
+            total = antiguos.count()
+            self.stdout.write(self.style.WARNING(
+                f"🔍 SIMULACIÓN: se borrarían {total} intentos anteriores a {limite:%Y-%m-%d}."
+            ))
+            return
+
+        total_borrados = 0
+        while True:
+            # DELETE por lotes vía subconsulta de PKs: mantiene cada
+            # transacción corta aunque haya millones de filas vencidas
+            lote = list(antiguos.values_list('pk', flat=True)[:BATCH_SIZE])
+            if not lote:
+                break
+            borrados, _ = IntentosLogin.objects.filter(pk__in=lote).delete()
+            total_borrados += borrados
+            self.stdout.write(f"  Borrados {total_borrados} registros...")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Purga completada: {total_borrados} intentos anteriores a {limite:%Y-%m-%d} eliminados."
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.17 on 2026-08-27 21:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('usuarios', '0002_alter_usuario_foto'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(condition=models.Q(('bloqueado_hasta__isnull', False)), fields=['bloqueado_hasta'], name='idx_usuario_bloqueado'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.17 on 2026-08-27 21:27
+
+import django.core.validators
+import re
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0003_usuario_idx_usuario_bloqueado'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usuario',
+            name='cedula',
+            field=models.CharField(db_column='cedula', max_length=10, unique=True, validators=[django.core.validators.RegexValidator(message='La cédula debe tener exactamente 10 dígitos.', regex=re.compile('^\\d{10}$', re.ASCII))]),
+        ),
+        migrations.AlterField(
+            model_name='usuario',
+            name='celular',
+            field=models.CharField(blank=True, db_column='celular', help_text='Celular del usuario (opcional para menores sin celular propio)', max_length=15, null=True, unique=True, validators=[django.core.validators.RegexValidator(message='El celular debe tener entre 9 y 15 dígitos (formato E.164: +593XXXXXXXXX).', regex=re.compile('^\\+?\\d{9,15}$', re.ASCII))]),
+        ),
+    ]
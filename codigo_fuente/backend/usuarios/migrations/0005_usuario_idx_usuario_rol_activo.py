@@ -0,0 +1,18 @@
+# Generated by Django 5.2.17 on 2026-08-27 21:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('usuarios', '0004_alter_usuario_cedula_alter_usuario_celular'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(fields=['id_rol', 'is_active'], name='idx_usuario_rol_activo'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.17 on 2026-08-27 21:37
+
+import usuarios.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0005_usuario_idx_usuario_rol_activo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usuario',
+            name='cedula',
+            field=models.CharField(db_column='cedula', max_length=10, unique=True, validators=[usuarios.models.cedula_validator]),
+        ),
+        migrations.AlterField(
+            model_name='usuario',
+            name='celular',
+            field=models.CharField(blank=True, db_column='celular', help_text='Celular del usuario (opcional para menores sin celular propio)', max_length=15, null=True, unique=True, validators=[usuarios.models.celular_validator]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.17 on 2026-08-27 21:40
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0006_alter_usuario_cedula_alter_usuario_celular'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usuario',
+            name='intentos_fallidos',
+            field=models.PositiveSmallIntegerField(db_column='intentos_fallidos', default=0, help_text='Contador de intentos de login fallidos consecutivos. Al llegar a 20 se desactiva la cuenta automáticamente.', validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(25)]),
+        ),
+    ]
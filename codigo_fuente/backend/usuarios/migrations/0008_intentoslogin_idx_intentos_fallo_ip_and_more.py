@@ -0,0 +1,21 @@
+# Generated by Django 5.2.17 on 2026-08-27 21:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0007_alter_usuario_intentos_fallidos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='intentoslogin',
+            index=models.Index(condition=models.Q(('exitoso', False)), fields=['ip_address', '-created_at'], name='idx_intentos_fallo_ip'),
+        ),
+        migrations.AddIndex(
+            model_name='intentoslogin',
+            index=models.Index(condition=models.Q(('exitoso', False)), fields=['cedula_intentada', '-created_at'], name='idx_intentos_fallo_cedula'),
+        ),
+    ]
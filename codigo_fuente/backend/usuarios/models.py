@@ -1,9 +1,11 @@
 # usuarios/models.py
+import re
+
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
-from django.core.exceptions import ObjectDoesNotExist
-from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
-from datetime import date
+from datetime import date, timedelta
 from usuarios.utils import normalizar_celular_ecuador
 from django.utils import timezone
 
@@ -30,8 +32,32 @@ TIEMPO_BLOQUEO_2 = 30   # Minutos del segundo bloqueo
 TIEMPO_BLOQUEO_3 = 60   # Minutos del tercer bloqueo
 
 LIMITE_CONTADOR = 25    # Límite máximo del contador (por seguridad, mayor a 20)
+
+# Campos que activan las reglas centralizadas de Usuario.save(); un save()
+# con update_fields que no toque ninguno puede saltarse toda esa lógica
+_CAMPOS_CON_REGLAS = frozenset({
+    'celular', 'email', 'id_rol', 'is_active', 'is_staff', 'is_superuser',
+    'intentos_fallidos',
+})
 # ---------------- Manager ----------------
 class UsuarioManager(BaseUserManager):
+    # Rol admin memoizado a nivel de clase: es una fila fija (id_rol=1) que
+    # create_superuser consultaba en cada invocación
+    _admin_rol = None
+
+    def _get_admin_rol(self):
+        if UsuarioManager._admin_rol is None:
+            UsuarioManager._admin_rol = Rol.objects.get(id_rol=ADMIN_ROLE_ID)
+        return UsuarioManager._admin_rol
+
+    def get_queryset(self):
+        # El rol viaja en el mismo JOIN por defecto: los serializers exponen
+        # rol_nombre (id_rol.rol) y sin esto cada usuario listado dispara un
+        # SELECT extra sobre rol. update()/values() no se ven afectados.
+        # Ojo: un .only()/.defer() que difiera id_rol no compila con este
+        # JOIN heredado; esos consumidores deben encadenar select_related(None).
+        return super().get_queryset().select_related('id_rol')
+
     def create_user(self, cedula, password=None, **extra_fields):
         if not cedula:
             raise ValueError('La cédula es obligatoria')
@@ -71,32 +97,54 @@ class UsuarioManager(BaseUserManager):
         # Asegurar rol administrador del sistema (id_rol=1)
         if 'id_rol' not in extra_fields or extra_fields['id_rol'] is None:
             try:
-                from usuarios.models import Rol
-                extra_fields['id_rol'] = Rol.objects.get(id_rol=ADMIN_ROLE_ID)
+                extra_fields['id_rol'] = self._get_admin_rol()
             except ObjectDoesNotExist:
                 raise ValueError("Debe existir un rol 'administrador' con id_rol=1 en la base de datos")
         else:
-            # Si vino otro rol, forzar que sea admin del sistema (1)
-            try:
-                from usuarios.models import Rol
-                rol_val = extra_fields['id_rol']
-                if isinstance(rol_val, int):
-                    if rol_val != ADMIN_ROLE_ID:
-                        raise ValueError("El superusuario debe tener id_rol=1 (administrador del sistema).")
-                elif isinstance(rol_val, Rol) and rol_val.id_rol != ADMIN_ROLE_ID:
-                    raise ValueError("El superusuario debe tener id_rol=1 (administrador del sistema).")
-            except Exception:
-                pass
+            # Si vino otro rol, forzar que sea admin del sistema (1).
+            # getattr cubre tanto instancias de Rol como ids planos, y el
+            # error ya no se traga en un except genérico.
+            rol_id = getattr(extra_fields['id_rol'], 'id_rol', extra_fields['id_rol'])
+            if isinstance(rol_id, int) and rol_id != ADMIN_ROLE_ID:
+                raise ValueError("El superusuario debe tener id_rol=1 (administrador del sistema).")
 
         user = self.create_user(cedula, password, **extra_fields)
 
         # Por seguridad, garantizar flags (aunque save() también los eleva con rol 1)
         user.is_staff = True
         user.is_superuser = True
-        user.save(using=self._db)
+        # Solo viajan las dos columnas de flags, no toda la fila otra vez
+        user.save(using=self._db, update_fields=['is_staff', 'is_superuser'])
 
         return user
 
+    def reactivar_cuentas(self, pks):
+        """
+        Reactiva un lote de cuentas bloqueadas/desactivadas en dos UPDATE
+        (usuarios + odontólogos) en vez de N pares SELECT+save. Limpia
+        también los espejos de bloqueo en cache para que el login no siga
+        rechazando por el TTL restante.
+        """
+        pks = list(pks)
+        cedulas = list(self.filter(pk__in=pks).values_list('cedula', flat=True))
+        actualizados = self.filter(pk__in=pks).update(
+            is_active=True,
+            intentos_fallidos=0,
+            ultimo_intento_fallido=None,
+            bloqueado_hasta=None,
+        )
+
+        from odontologos.models import Odontologo
+        Odontologo.objects.filter(id_usuario__in=pks, activo=False).update(activo=True)
+
+        from django.core.cache import cache
+        from usuarios.authentication import _INACTIVA_KEY, _LOCK_KEY
+        cache.delete_many(
+            [_LOCK_KEY.format(c) for c in cedulas]
+            + [_INACTIVA_KEY.format(c) for c in cedulas]
+        )
+        return actualizados
+
 
 # ---------------- Rol ----------------
 class Rol(models.Model):
@@ -141,6 +189,18 @@ class IntentosLogin(models.Model):
         indexes = [
             models.Index(fields=['cedula_intentada', '-created_at']),
             models.Index(fields=['ip_address', '-created_at']),
+            # Índices parciales solo de fallos: las consultas anti-fraude
+            # cuentan intentos fallidos por IP/cédula en ventanas recientes
+            models.Index(
+                fields=['ip_address', '-created_at'],
+                condition=models.Q(exitoso=False),
+                name='idx_intentos_fallo_ip',
+            ),
+            models.Index(
+                fields=['cedula_intentada', '-created_at'],
+                condition=models.Q(exitoso=False),
+                name='idx_intentos_fallo_cedula',
+            ),
         ]
     
     def __str__(self):
@@ -157,12 +217,22 @@ TIPO_SANGRE_CHOICES = [
     ('Desconocido', 'Desconocido')
 ]
 
-cedula_validator = RegexValidator(
-    regex=r'^\d{10}$', message='La cédula debe tener exactamente 10 dígitos.'
-)
-celular_validator = RegexValidator(
-    regex=r'^\+?\d{9,15}$', message='El celular debe tener entre 9 y 15 dígitos (formato E.164: +593XXXXXXXXX).'
-)
+# Patrones precompilados una sola vez al cargar el módulo (re.ASCII: \d no
+# consulta las tablas Unicode). Validadores como funciones con pre-chequeo
+# de longitud: la mayoría de entradas inválidas se descartan sin ejecutar
+# el motor de regex.
+_CEDULA_RE = re.compile(r'^\d{10}$', re.ASCII)
+_CELULAR_RE = re.compile(r'^\+?\d{9,15}$', re.ASCII)
+
+
+def cedula_validator(value):
+    if len(value) != 10 or not _CEDULA_RE.match(value):
+        raise ValidationError('La cédula debe tener exactamente 10 dígitos.')
+
+
+def celular_validator(value):
+    if not 9 <= len(value) <= 16 or not _CELULAR_RE.match(value):
+        raise ValidationError('El celular debe tener entre 9 y 15 dígitos (formato E.164: +593XXXXXXXXX).')
 
 class Usuario(AbstractBaseUser, PermissionsMixin):
     # PK primero
@@ -200,7 +270,9 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     is_staff = models.BooleanField(default=False, db_column='is_staff')    # acceso a /admin
 
     # Control de intentos fallidos y bloqueo temporal
-    intentos_fallidos = models.IntegerField(
+    # PositiveSmallIntegerField: 2 bytes en vez de 4, el contador nunca
+    # supera LIMITE_CONTADOR (25)
+    intentos_fallidos = models.PositiveSmallIntegerField(
         default=0,
         db_column='intentos_fallidos',
         validators=[MinValueValidator(0), MaxValueValidator(25)],
@@ -234,24 +306,124 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     class Meta:
         db_table = 'usuario'
         ordering = ['id_usuario']
+        indexes = [
+            # Índice parcial: solo las pocas filas con bloqueo vigente,
+            # para el chequeo "¿está bloqueado?" del backend de login
+            models.Index(
+                fields=['bloqueado_hasta'],
+                condition=models.Q(bloqueado_hasta__isnull=False),
+                name='idx_usuario_bloqueado',
+            ),
+            # Listados por rol filtrados por estado (admin, reportes)
+            models.Index(fields=['id_rol', 'is_active'], name='idx_usuario_rol_activo'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Snapshot de los campos que gobiernan las reglas de save(): permite
+        # detectar reactivaciones y saltarse normalización/flags cuando el
+        # campo no cambió, sin releer la fila (detección de campos sucios)
+        instance = super().from_db(db, field_names, values)
+        cargados = dict(zip(field_names, values))
+        instance._valores_cargados = {
+            campo: cargados[campo]
+            for campo in ('celular', 'email', 'id_rol_id', 'is_active',
+                          'is_staff', 'is_superuser')
+            if campo in cargados
+        }
+        if 'is_active' in cargados:
+            instance._loaded_is_active = cargados['is_active']
+        return instance
+
+    def _campo_cambiado(self, campo):
+        # True si el campo difiere del valor cargado de la BD; instancias
+        # nuevas o campos diferidos cuentan como cambiados (camino seguro)
+        cargados = getattr(self, '_valores_cargados', None)
+        if cargados is None or campo not in cargados:
+            return True
+        return getattr(self, campo) != cargados[campo]
 
     def __str__(self):
         return f"{self.primer_nombre} {self.primer_apellido} {self.segundo_apellido}"
-    
+
     def es_menor_edad(self):
-        # Calcula si el usuario es menor de 18 años
-        hoy = date.today()
-        edad = hoy.year - self.fecha_nacimiento.year
-        if (hoy.month, hoy.day) < (self.fecha_nacimiento.month, self.fecha_nacimiento.day):
-            edad -= 1
-        return edad < 18
+        # Calcula si el usuario es menor de 18 años. Memoizado por instancia:
+        # la fecha de nacimiento no cambia, así que al serializar lotes el
+        # cálculo de fecha se hace una sola vez por objeto.
+        resultado = self.__dict__.get('_es_menor_edad')
+        if resultado is None:
+            hoy = date.today()
+            nacimiento = self.fecha_nacimiento
+            edad = hoy.year - nacimiento.year
+            if (hoy.month, hoy.day) < (nacimiento.month, nacimiento.day):
+                edad -= 1
+            resultado = self.__dict__['_es_menor_edad'] = edad < 18
+        return resultado
     
     def resetear_intentos_login(self):
+        # UPDATE directo: un solo statement, sin pasar por el save() del
+        # modelo (que se dispara en cada login exitoso)
+        Usuario.objects.filter(pk=self.pk).update(
+            intentos_fallidos=0,
+            ultimo_intento_fallido=None,
+            bloqueado_hasta=None,
+        )
         self.intentos_fallidos = 0
         self.ultimo_intento_fallido = None
         self.bloqueado_hasta = None
-        self.save(update_fields=['intentos_fallidos', 'ultimo_intento_fallido', 'bloqueado_hasta'])
+
+        # Borrar también el espejo del bloqueo en cache: si queda, el fast
+        # path del backend sigue rechazando a la cuenta ya desbloqueada
+        # hasta que venza el TTL original (igual que en reactivar_cuentas)
+        from django.core.cache import cache
+        from usuarios.authentication import _INACTIVA_KEY, _LOCK_KEY
+        cache.delete_many([
+            _LOCK_KEY.format(self.cedula),
+            _INACTIVA_KEY.format(self.cedula),
+        ])
     
+    @classmethod
+    def registrar_intento_fallido(cls, pk):
+        """
+        Suma un intento fallido y aplica el bloqueo escalonado en UN solo
+        UPDATE atómico: el incremento va como F() y el umbral se resuelve
+        con Case/When sobre el valor en BD, así dos fallos concurrentes no
+        se pisan el contador ni el bloqueo. Las condiciones comparan contra
+        el valor ANTES del incremento (umbral - 1).
+        """
+        ahora = timezone.now()
+        return cls.objects.filter(pk=pk).update(
+            intentos_fallidos=models.F('intentos_fallidos') + 1,
+            ultimo_intento_fallido=ahora,
+            is_active=models.Case(
+                models.When(
+                    intentos_fallidos__gte=MAX_INTENTOS_ANTES_DESACTIVAR - 1,
+                    then=models.Value(False),
+                ),
+                default=models.F('is_active'),
+            ),
+            bloqueado_hasta=models.Case(
+                # 20+: cuenta desactivada, ya no necesita bloqueo temporal
+                models.When(
+                    intentos_fallidos__gte=MAX_INTENTOS_ANTES_DESACTIVAR - 1,
+                    then=models.Value(None),
+                ),
+                models.When(
+                    intentos_fallidos__gte=MAX_INTENTOS_ANTES_BLOQUEO_3 - 1,
+                    then=models.Value(ahora + timedelta(minutes=TIEMPO_BLOQUEO_3)),
+                ),
+                models.When(
+                    intentos_fallidos__gte=MAX_INTENTOS_ANTES_BLOQUEO_2 - 1,
+                    then=models.Value(ahora + timedelta(minutes=TIEMPO_BLOQUEO_2)),
+                ),
+                models.When(
+                    intentos_fallidos__gte=MAX_INTENTOS_ANTES_BLOQUEO_1 - 1,
+                    then=models.Value(ahora + timedelta(minutes=TIEMPO_BLOQUEO_1)),
+                ),
+                default=models.Value(None),
+            ),
+        )
+
     def set_foto_encriptada(self, url_plana: str):
         # Encripta y guarda la URL de la foto
         from usuarios.utils import encriptar_url
@@ -272,19 +444,19 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     
     def esta_bloqueado_temporalmente(self):
         # Verifica si la cuenta está actualmente bloqueada por intentos fallidos.
-
-        
-        if not self.bloqueado_hasta:
+        bloqueado_hasta = self.bloqueado_hasta
+        if not bloqueado_hasta:
             return False, 0
-        
-        if self.bloqueado_hasta <= timezone.now():
+
+        ahora = timezone.now()  # una sola lectura del reloj
+        if bloqueado_hasta <= ahora:
             # El bloqueo ya expiró
             return False, 0
-        
-        # Calcular minutos restantes
-        segundos_restantes = (self.bloqueado_hasta - timezone.now()).total_seconds()
-        minutos_restantes = int(segundos_restantes / 60) + 1  # Redondear hacia arriba
-        
+
+        # Minutos restantes redondeados hacia arriba (ceil entero, sin floats)
+        segundos_restantes = int((bloqueado_hasta - ahora).total_seconds())
+        minutos_restantes = -(-segundos_restantes // 60)
+
         return True, minutos_restantes
 
     def save(self, *args, **kwargs):
@@ -298,48 +470,62 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
         - Si is_active cambia a True: resetea intentos fallidos y desbloquea
         - Limita intentos_fallidos a máximo 10 (seguridad anti-fuerza bruta)
         """
+        # Atajo: si el save() declara update_fields y ninguno activa las
+        # reglas de arriba, no hay nada que recalcular
+        uf = kwargs.get('update_fields')
+        if uf is not None and _CAMPOS_CON_REGLAS.isdisjoint(uf):
+            return super().save(*args, **kwargs)
+
         # Detectar si la cuenta está siendo reactivada (is_active: False → True)
-        if self.pk:  # Solo si el usuario ya existe en BD
-            try:
-                usuario_anterior = Usuario.objects.get(pk=self.pk)
-                # Si cambió de inactivo a activo, resetear intentos
-                if not usuario_anterior.is_active and self.is_active:
-                    self.intentos_fallidos = 0
-                    self.ultimo_intento_fallido = None
-                    self.bloqueado_hasta = None
-            except Usuario.DoesNotExist:
-                pass  # Usuario nuevo, no hacer nada
+        # comparando contra el valor cargado por from_db, sin releer la fila
+        if self.pk and self.is_active and getattr(self, '_loaded_is_active', True) is False:
+            self.intentos_fallidos = 0
+            self.ultimo_intento_fallido = None
+            self.bloqueado_hasta = None
         
-        # Normalizar celular a formato E.164
-        if self.celular:
+        # Normalizar celular a formato E.164 (solo si cambió)
+        if self.celular and self._campo_cambiado('celular'):
             celular_normalizado = normalizar_celular_ecuador(self.celular)
             if celular_normalizado:
                 self.celular = celular_normalizado
         
-        # Gestión de flags según rol
-        if self.id_rol_id == ADMIN_ROLE_ID:
-            self.is_staff = True
-            self.is_superuser = True
-        else:
-            self.is_superuser = False
+        # Gestión de flags según rol: solo cuando rol o flags se tocaron
+        # (en un save sin cambios de rol los flags ya quedaron consistentes)
+        if (self._campo_cambiado('id_rol_id') or self._campo_cambiado('is_staff')
+                or self._campo_cambiado('is_superuser')):
+            if self.id_rol_id == ADMIN_ROLE_ID:
+                self.is_staff = True
+                self.is_superuser = True
+            else:
+                self.is_superuser = False
         
-        # Generar email ficticio si no tiene email
+        # Generar email ficticio si no tiene email (concatenación simple:
+        # no hay nada que formatear)
         if not self.email:
-            self.email = f"cedula{self.cedula}@oralflow.system"
+            self.email = 'cedula' + self.cedula + '@oralflow.system'
         
         # Limitar intentos_fallidos al máximo permitido (seguridad)
         if self.intentos_fallidos > LIMITE_CONTADOR:
             self.intentos_fallidos = LIMITE_CONTADOR
         
         super().save(*args, **kwargs)
-        
+
+        # El estado recién escrito pasa a ser el "cargado" para saves
+        # posteriores sobre la misma instancia
+        desactivado = not self.is_active and getattr(self, '_loaded_is_active', True)
+        self._loaded_is_active = self.is_active
+        cargados = getattr(self, '_valores_cargados', None)
+        if cargados is not None:
+            for campo in cargados:
+                cargados[campo] = getattr(self, campo)
+
         # Si el usuario se desactiva, desactivar también su registro de odontólogo
-        if not self.is_active:
+        # (solo en la transición True → False, no en cada save de una cuenta inactiva)
+        if desactivado:
             try:
                 from odontologos.models import Odontologo
-                odontologo = Odontologo.objects.filter(id_usuario=self).first()
-                if odontologo and odontologo.activo:
-                    odontologo.activo = False
-                    odontologo.save()
+                # UPDATE directo: sin SELECT previo ni save() anidado; si no
+                # hay registro (o ya está inactivo) no toca ninguna fila
+                Odontologo.objects.filter(id_usuario=self, activo=True).update(activo=False)
             except Exception:
                 pass  # Si no existe o hay error, continuar
\ No newline at end of file
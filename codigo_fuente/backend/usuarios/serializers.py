@@ -1,35 +1,106 @@
 # usuarios/serializers.py
+from bisect import bisect_right
+from functools import lru_cache
+
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from django.contrib.auth.models import update_last_login
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from .models import (
-    Rol, Usuario, LIMITE_CONTADOR,
+    Rol, Usuario,
     MAX_INTENTOS_ANTES_BLOQUEO_1, MAX_INTENTOS_ANTES_BLOQUEO_2,
     MAX_INTENTOS_ANTES_BLOQUEO_3, MAX_INTENTOS_ANTES_DESACTIVAR,
-    TIEMPO_BLOQUEO_1, TIEMPO_BLOQUEO_2, TIEMPO_BLOQUEO_3
 )
 from pacientes.models import Paciente
 
 ADMIN_ROLE_ID = 1
 ADMIN_CLINICO_ROLE_ID = 4
 
+# Escalera de mensajes de bloqueo como tabla ordenada: bisect sobre los
+# umbrales (misma técnica que en authentication.py) en vez de una cadena de
+# elif; agregar un nivel es agregar una fila
+_UMBRALES_MENSAJE = (
+    MAX_INTENTOS_ANTES_BLOQUEO_1, MAX_INTENTOS_ANTES_BLOQUEO_2,
+    MAX_INTENTOS_ANTES_BLOQUEO_3, MAX_INTENTOS_ANTES_DESACTIVAR,
+)
+# Por nivel: (duración del bloqueo, umbral del siguiente nivel, texto del tramo)
+_NIVELES_MENSAJE = (
+    (None, MAX_INTENTOS_ANTES_BLOQUEO_1, None),
+    ('15 minutos', MAX_INTENTOS_ANTES_BLOQUEO_2, 'del próximo nivel'),
+    ('30 minutos', MAX_INTENTOS_ANTES_BLOQUEO_3, 'del próximo nivel'),
+    ('1 hora', MAX_INTENTOS_ANTES_DESACTIVAR, 'de desactivación'),
+    (None, None, None),
+)
+
+
+# La tabla rol es una referencia fija de 4 filas: se cachea por proceso para
+# que los flujos de creación masiva de usuarios no la consulten por fila
+@lru_cache(maxsize=32)
+def _rol_por_id(rol_id):
+    return Rol.objects.get(pk=rol_id)
+
+
+@receiver(post_save, sender='usuarios.Rol')
+@receiver(post_delete, sender='usuarios.Rol')
+def _limpiar_cache_roles(**kwargs):
+    _rol_por_id.cache_clear()
+
+
+class RolCacheField(serializers.PrimaryKeyRelatedField):
+    # Resuelve la FK de rol contra el cache en vez del SELECT por defecto
+    def to_internal_value(self, data):
+        try:
+            return _rol_por_id(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except Rol.DoesNotExist:
+            self.fail('does_not_exist', pk_value=data)
+
 class RolSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rol
         fields = ['id_rol', 'rol', 'created_at', 'updated_at']
 
 
-class UsuarioSerializer(serializers.ModelSerializer):
-    rol_nombre = serializers.CharField(source='id_rol.rol', read_only=True)
+class UsuarioListSerializer(serializers.ListSerializer):
+    # Desencriptado de fotos por lote: un solo bucle en vez de pagar el
+    # try/except del SerializerMethodField de cada fila. desencriptar_url
+    # resuelve formato nuevo (AES-GCM) y legado (Fernet) con ciphers ya
+    # memoizados
+    def to_representation(self, data):
+        from usuarios.utils import desencriptar_url
+        items = list(data.all() if hasattr(data, 'all') else data)
+        # id_paciente en bloque para listas que no vienen del queryset
+        # anotado del ViewSet: un solo SELECT con IN en vez de una query
+        # por fila en el method field
+        sin_anotar = [u for u in items if '_id_paciente' not in u.__dict__ and u.pk]
+        if sin_anotar:
+            paciente_map = dict(
+                Paciente.objects.filter(
+                    id_usuario_id__in=[u.pk for u in sin_anotar]
+                ).values_list('id_usuario_id', 'id_paciente')
+            )
+            for usuario in sin_anotar:
+                usuario._id_paciente = paciente_map.get(usuario.pk)
+        for usuario in items:
+            if usuario.foto:
+                try:
+                    usuario._foto_desencriptada = desencriptar_url(usuario.foto)
+                except Exception:
+                    usuario._foto_desencriptada = None
+            else:
+                usuario._foto_desencriptada = None
+        return [self.child.to_representation(item) for item in items]
 
-    # Alias de email por compatibilidad
-    usuario_email = serializers.EmailField(source='email', required=False)
 
-    # Exponer is_active (solo lectura, para clientes que ya consumen is_active)
-    is_active = serializers.BooleanField(read_only=True)
+class UsuarioSerializer(serializers.ModelSerializer):
+    rol_nombre = serializers.CharField(source='id_rol.rol', read_only=True)
+    id_rol = RolCacheField(queryset=Rol.objects.all())
 
-    # Campo "activo" editable que mapea a is_active en el modelo
-    activo = serializers.BooleanField(source='is_active', required=False)
+    # is_active solo se edita vía el alias 'activo' (remapeado en
+    # to_internal_value); la entrada directa se descarta como antes
+    is_active = serializers.BooleanField(required=False)
 
     id_paciente = serializers.SerializerMethodField()
     
@@ -39,14 +110,12 @@ class UsuarioSerializer(serializers.ModelSerializer):
     # ---- Flags de acceso ----
     is_superuser = serializers.BooleanField(read_only=True)
     is_staff = serializers.BooleanField(required=False, default=serializers.empty)
-    staff = serializers.BooleanField(source='is_staff', required=False, default=serializers.empty)
 
     class Meta:
         model = Usuario
         fields = [
             'id_usuario',
             'email',
-            'usuario_email',
             'password',      
             'primer_nombre',
             'segundo_nombre',
@@ -63,11 +132,9 @@ class UsuarioSerializer(serializers.ModelSerializer):
             "id_paciente",
 
             # Flags
-            'is_active',         
-            'activo',              
-            'is_staff',          
-            'staff',             
-            'is_superuser',     
+            'is_active',
+            'is_staff',
+            'is_superuser',
 
             # Auditoría
             'created_at',
@@ -78,51 +145,105 @@ class UsuarioSerializer(serializers.ModelSerializer):
             'created_at': {'read_only': True},
             'updated_at': {'read_only': True},
         }
+        list_serializer_class = UsuarioListSerializer
 
     def get_id_paciente(self, obj):
-            try:
-                paciente = Paciente.objects.get(id_usuario=obj)
-                return paciente.id_paciente
-            except Paciente.DoesNotExist:
-                return None
+        # El ViewSet anota _id_paciente como subconsulta escalar, así que en
+        # listados no hay query por fila; el accessor inverso queda como
+        # fallback para instancias fuera de ese queryset (p. ej. request.user)
+        try:
+            return obj._id_paciente
+        except AttributeError:
+            pass
+        try:
+            return obj.paciente.id_paciente
+        except Paciente.DoesNotExist:
+            return None
     
     def get_foto(self, obj):
-        # Retorna la URL de la foto desencriptada
+        # Retorna la URL de la foto desencriptada (en listados ya viene
+        # resuelta por el bucle del UsuarioListSerializer)
+        try:
+            return obj._foto_desencriptada
+        except AttributeError:
+            pass
         try:
             return obj.get_foto_desencriptada()
         except Exception:
             return None
 
     def to_internal_value(self, data):
-        # Si es creación (no hay instance), eliminar is_staff del data
-        if not self.instance:
+        # Aliases de compatibilidad (usuario_email/staff/activo) resueltos
+        # renombrando claves: cada alias era un Field duplicado más que DRF
+        # tenía que validar en cada (de)serialización. El payload solo se
+        # clona si de verdad hay algo que remapear: copiar un QueryDict con
+        # una foto base64 adentro no es gratis
+        necesita_copia = (
+            ('usuario_email' in data and 'email' not in data)
+            or ('staff' in data and 'is_staff' not in data)
+            or 'is_active' in data
+            or 'activo' in data
+            or (not self.instance and 'is_staff' in data)
+        )
+        if necesita_copia:
             data = data.copy() if hasattr(data, 'copy') else dict(data)
-            data.pop('is_staff', None)
-            data.pop('staff', None)
+            if 'usuario_email' in data and 'email' not in data:
+                data['email'] = data['usuario_email']
+            if 'staff' in data and 'is_staff' not in data:
+                data['is_staff'] = data['staff']
+            # is_active directo se ignora; solo el alias 'activo' lo edita
+            data.pop('is_active', None)
+            if 'activo' in data:
+                data['is_active'] = data['activo']
+            # Si es creación (no hay instance), eliminar is_staff del data
+            if not self.instance:
+                data.pop('is_staff', None)
         return super().to_internal_value(data)
 
+    def to_representation(self, instance):
+        # Cache por instancia dentro del ciclo de vida del serializer: si el
+        # mismo Usuario aparece varias veces (listado + contexto anidado) se
+        # reusa el dict ya armado en vez de re-serializar ~25 campos
+        cache = self.__dict__.setdefault('_repr_cache', {})
+        clave = id(instance)
+        ret = cache.get(clave)
+        if ret is not None:
+            return ret
+        ret = super().to_representation(instance)
+        # Aliases de lectura que los clientes existentes consumen
+        ret['usuario_email'] = ret.get('email')
+        ret['activo'] = ret.get('is_active')
+        ret['staff'] = ret.get('is_staff')
+        cache[clave] = ret
+        return ret
+
     # --------- Validaciones ---------
     def validate(self, attrs):
         cedula = attrs.get("cedula")
         email = attrs.get("email")
         celular = attrs.get("celular")
-        qs = Usuario.objects.all()
-
-        # Unicidad
-        if self.instance is None:
-            if cedula and qs.filter(cedula=cedula).exists():
-                raise serializers.ValidationError({"cedula": "La cédula ya está registrada."})
-            if email and qs.filter(email=email).exists():
-                raise serializers.ValidationError({"email": "El correo ya está registrado."})
-            if celular and qs.filter(celular=celular).exists():
-                raise serializers.ValidationError({"celular": "El celular ya está registrado."})
-        else:
-            if cedula and qs.exclude(pk=self.instance.pk).filter(cedula=cedula).exists():
-                raise serializers.ValidationError({"cedula": "La cédula ya está registrada."})
-            if email and qs.exclude(pk=self.instance.pk).filter(email=email).exists():
-                raise serializers.ValidationError({"email": "El correo ya está registrado."})
-            if celular and qs.exclude(pk=self.instance.pk).filter(celular=celular).exists():
-                raise serializers.ValidationError({"celular": "El celular ya está registrado."})
+
+        # Unicidad: un solo SELECT con OR en vez de un exists() por campo;
+        # las filas en conflicto se atribuyen al campo correcto en Python
+        filtros = Q()
+        if cedula:
+            filtros |= Q(cedula=cedula)
+        if email:
+            filtros |= Q(email=email)
+        if celular:
+            filtros |= Q(celular=celular)
+
+        if filtros:
+            qs = Usuario.objects.filter(filtros)
+            if self.instance is not None:
+                qs = qs.exclude(pk=self.instance.pk)
+            for fila in qs.values('cedula', 'email', 'celular')[:3]:
+                if cedula and fila['cedula'] == cedula:
+                    raise serializers.ValidationError({"cedula": "La cédula ya está registrada."})
+                if email and fila['email'] == email:
+                    raise serializers.ValidationError({"email": "El correo ya está registrado."})
+                if celular and fila['celular'] == celular:
+                    raise serializers.ValidationError({"celular": "El celular ya está registrado."})
 
         return attrs
 
@@ -190,7 +311,16 @@ class UsuarioSerializer(serializers.ModelSerializer):
 
         # Validar que tenga registro de paciente si desactiva is_staff
         if cambio_is_staff and not nuevo_is_staff:
-            tiene_paciente = Paciente.objects.filter(id_usuario=instance).exists()
+            # La anotación _id_paciente del ViewSet (o la relación inversa ya
+            # cacheada) responde sin query; el exists() queda solo como
+            # fallback para instancias cargadas fuera de ese queryset
+            anotado = instance.__dict__.get('_id_paciente', False)
+            if anotado is not False:
+                tiene_paciente = anotado is not None
+            elif 'paciente' in instance._state.fields_cache:
+                tiene_paciente = instance._state.fields_cache['paciente'] is not None
+            else:
+                tiene_paciente = Paciente.objects.filter(id_usuario_id=instance.pk).exists()
             if not tiene_paciente:
                 raise serializers.ValidationError({
                     "is_staff": "No puede desactivar is_staff sin tener registro de paciente. "
@@ -239,7 +369,7 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         y manejar errores de bloqueo personalizados CON registro en BD
         """
         from django.utils import timezone
-        from datetime import timedelta
+        from usuarios import intentos_buffer
         from usuarios.models import IntentosLogin
         
         # Mapear cedula a username para que el padre funcione correctamente
@@ -257,19 +387,21 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
             else:
                 ip_address = request.META.get('REMOTE_ADDR', '0.0.0.0')
         
+        # Una sola carga del usuario para todo el método: los caminos de
+        # éxito y fallo reutilizan esta instancia en vez de repetir el get
+        usuario = Usuario.objects.filter(cedula=cedula).first()
+
         # Verificar si el usuario está bloqueado ANTES de intentar autenticar
-        try:
-            usuario = Usuario.objects.get(cedula=cedula)
-            
+        if usuario is not None:
             # Si la cuenta está desactivada, rechazar inmediatamente (no incrementar más)
             if not usuario.is_active:
                 # Registrar intento pero NO incrementar contador
-                IntentosLogin.objects.create(
+                intentos_buffer.registrar(IntentosLogin(
                     id_usuario=usuario,
                     cedula_intentada=cedula,
                     ip_address=ip_address,
                     exitoso=False
-                )
+                ))
                 
                 raise serializers.ValidationError({
                     "detail": "Cuenta desactivada por múltiples intentos fallidos. Contacta al administrador.",
@@ -288,121 +420,83 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
                 tiempo_restante = int((usuario.bloqueado_hasta - timezone.now()).total_seconds() / 60)
                 
                 # Registrar intento durante bloqueo
-                IntentosLogin.objects.create(
+                intentos_buffer.registrar(IntentosLogin(
                     id_usuario=usuario,
                     cedula_intentada=cedula,
                     ip_address=ip_address,
                     exitoso=False
-                )
+                ))
                 
                 raise serializers.ValidationError({
                     "detail": f"Cuenta bloqueada temporalmente. Intenta nuevamente en {tiempo_restante} minutos.",
                     "bloqueado": True,
                     "minutos_restantes": tiempo_restante
                 })
-            
-        except Usuario.DoesNotExist:
-            IntentosLogin.objects.create(
-                id_usuario=None,
-                cedula_intentada=cedula,
-                ip_address=ip_address,
-                exitoso=False
-            )
+        # Si la cédula no existe, super().validate() igual llama a
+        # authenticate() y el backend registra el intento (con verificación
+        # señuelo contra timing attacks); no se duplica la auditoría aquí
         
         try:
-            data = super().validate(attrs)
-            
-            # Login exitoso: resetear intentos y registrar éxito
-            try:
-                usuario = Usuario.objects.get(cedula=cedula)
-                if usuario.intentos_fallidos > 0 or usuario.ultimo_intento_fallido:
-                    usuario.intentos_fallidos = 0
-                    usuario.ultimo_intento_fallido = None
-                    usuario.bloqueado_hasta = None
-                    usuario.save(update_fields=['intentos_fallidos', 'ultimo_intento_fallido', 'bloqueado_hasta'])
-                
-                # Registrar intento exitoso
-                IntentosLogin.objects.create(
-                    id_usuario=usuario,
-                    cedula_intentada=cedula,
-                    ip_address=ip_address,
-                    exitoso=True
-                )
-            except Usuario.DoesNotExist:
-                pass
-            
-            return data
+            # super().validate() → authenticate() → CedulaAuthenticationBackend:
+            # el backend registra el intento (éxito o fallo), incrementa el
+            # contador de forma atómica (F()) y mantiene el espejo en cache
+            return super().validate(attrs)
             
         except Exception as e:
-            # Si falla la autenticación, incrementar contador e intentos
-            try:
-                usuario = Usuario.objects.get(cedula=cedula)
+            # Si falla la autenticación, construir el mensaje de escalamiento.
+            # El backend ya incrementó el contador y registró la auditoría;
+            # aquí solo se relee el estado resultante una vez para armar la
+            # respuesta, sin un segundo read-modify-write que duplique el
+            # incremento o pierda carreras.
+            if usuario is not None:
+                estado = Usuario.objects.values(
+                    'intentos_fallidos', 'bloqueado_hasta', 'is_active'
+                ).get(pk=usuario.pk)
+                intentos = estado['intentos_fallidos']
+                bloqueado_hasta = estado['bloqueado_hasta']
                 
-                # Registrar intento fallido
-                IntentosLogin.objects.create(
-                    id_usuario=usuario,
-                    cedula_intentada=cedula,
-                    ip_address=ip_address,
-                    exitoso=False
-                )
-                
-                # Incrementar contador
-                usuario.intentos_fallidos = min(usuario.intentos_fallidos + 1, LIMITE_CONTADOR)
-                usuario.ultimo_intento_fallido = timezone.now()
-                
-                # Sistema de bloqueo escalonado
-                if usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_DESACTIVAR:
-                    # 20+ intentos: DESACTIVAR CUENTA
-                    usuario.is_active = False
-                    usuario.bloqueado_hasta = None  # Ya no necesita bloqueo temporal
-                    mensaje_error = "Cuenta desactivada por múltiples intentos fallidos. Contacta al administrador."
-                    intentos_restantes = 0
-                elif usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_BLOQUEO_3:
-                    # 15-19 intentos: Bloqueo de 1 hora
-                    usuario.bloqueado_hasta = timezone.now() + timedelta(minutes=TIEMPO_BLOQUEO_3)
-                    intentos_restantes = MAX_INTENTOS_ANTES_DESACTIVAR - usuario.intentos_fallidos
-                    mensaje_error = f"Cuenta bloqueada por 1 hora. Intentos restantes antes de desactivación: {intentos_restantes}"
-                elif usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_BLOQUEO_2:
-                    # 10-14 intentos: Bloqueo de 30 minutos
-                    usuario.bloqueado_hasta = timezone.now() + timedelta(minutes=TIEMPO_BLOQUEO_2)
-                    intentos_restantes = MAX_INTENTOS_ANTES_BLOQUEO_3 - usuario.intentos_fallidos
-                    mensaje_error = f"Cuenta bloqueada por 30 minutos. Intentos restantes antes del próximo nivel: {intentos_restantes}"
-                elif usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_BLOQUEO_1:
-                    # 5-9 intentos: Bloqueo de 15 minutos
-                    usuario.bloqueado_hasta = timezone.now() + timedelta(minutes=TIEMPO_BLOQUEO_1)
-                    intentos_restantes = MAX_INTENTOS_ANTES_BLOQUEO_2 - usuario.intentos_fallidos
-                    mensaje_error = f"Cuenta bloqueada por 15 minutos. Intentos restantes antes del próximo nivel: {intentos_restantes}"
-                else:
-                    # 1-4 intentos: Solo advertencia
-                    intentos_restantes = MAX_INTENTOS_ANTES_BLOQUEO_1 - usuario.intentos_fallidos
-                    mensaje_error = f"Credenciales incorrectas. Te quedan {intentos_restantes} intentos antes del bloqueo."
-                
-                usuario.save(update_fields=['intentos_fallidos', 'ultimo_intento_fallido', 'bloqueado_hasta', 'is_active'])
-                
-                # Construir respuesta de error según el nivel
-                error_response = {"detail": mensaje_error}
-                
-                if usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_DESACTIVAR:
-                    error_response["desactivada"] = True
-                    error_response["requiere_admin"] = True
-                elif usuario.intentos_fallidos >= MAX_INTENTOS_ANTES_BLOQUEO_1:
-                    error_response["bloqueado"] = True
-                    if usuario.bloqueado_hasta:
-                        minutos = int((usuario.bloqueado_hasta - timezone.now()).total_seconds() / 60)
+                # Sistema de bloqueo escalonado: el nivel sale de un bisect
+                # sobre la tabla de umbrales y el mensaje de su fila
+                nivel = bisect_right(_UMBRALES_MENSAJE, intentos)
+                duracion, siguiente, tramo = _NIVELES_MENSAJE[nivel]
+
+                if nivel == len(_UMBRALES_MENSAJE):
+                    # Último nivel: cuenta desactivada
+                    error_response = {
+                        "detail": "Cuenta desactivada por múltiples intentos fallidos. Contacta al administrador.",
+                        "desactivada": True,
+                        "requiere_admin": True,
+                    }
+                elif nivel > 0:
+                    intentos_restantes = siguiente - intentos
+                    error_response = {
+                        "detail": f"Cuenta bloqueada por {duracion}. Intentos restantes antes {tramo}: {intentos_restantes}",
+                        "bloqueado": True,
+                    }
+                    if bloqueado_hasta:
+                        minutos = int((bloqueado_hasta - timezone.now()).total_seconds() / 60)
                         error_response["minutos_restantes"] = minutos
                 else:
-                    error_response["intentos_restantes"] = intentos_restantes
-                
+                    # Nivel 0: solo advertencia
+                    intentos_restantes = siguiente - intentos
+                    error_response = {
+                        "detail": f"Credenciales incorrectas. Te quedan {intentos_restantes} intentos antes del bloqueo.",
+                        "intentos_restantes": intentos_restantes,
+                    }
+
                 raise serializers.ValidationError(error_response)
-            except Usuario.DoesNotExist:
-                pass  # Usuario no existe, dejar error genérico
             
             raise e
-        
-        return data
     
     @classmethod
     def get_token(cls, user):
+        from django.db import transaction
+        from django.utils import timezone
+
         token = super().get_token(user)
-        update_last_login(None, user)
+        # last_login fuera del camino crítico del login: UPDATE dirigido
+        # (sin señales ni save completo) diferido a después del commit
+        transaction.on_commit(
+            lambda: Usuario.objects.filter(pk=user.pk).update(last_login=timezone.now())
+        )
         return token
\ No newline at end of file
@@ -0,0 +1,199 @@
+# usuarios/tasks.py
+# Envío de correos fuera del ciclo request/respuesta. Celery no es una
+# dependencia del proyecto, así que cada envío corre en un hilo daemon: la
+# vista responde sin esperar el render de plantillas ni el handshake SMTP
+# (TCP + STARTTLS + AUTH) y los reintentos quedan en segundo plano.
+import logging
+import os
+import threading
+import time
+from email.mime.image import MIMEImage
+from functools import lru_cache
+from smtplib import SMTPException
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+
+logger = logging.getLogger(__name__)
+
+MAX_REINTENTOS = 3
+ESPERA_REINTENTO = 30  # segundos entre reintentos
+
+# Conexión SMTP persistente por proceso: el handshake TCP + STARTTLS + AUTH
+# domina el costo de cada envío individual, así que la sesión se reusa entre
+# correos y solo se descarta cuando el servidor la corta
+_conexion_lock = threading.Lock()
+_conexion = None
+
+
+def _obtener_conexion():
+    global _conexion
+    if _conexion is None:
+        _conexion = get_connection()
+    # open() es no-op si la sesión sigue viva y reconecta si el backend
+    # todavía no abrió; el backend SMTP no la cierra tras send_messages
+    # porque no fue él quien la abrió
+    _conexion.open()
+    return _conexion
+
+
+def _descartar_conexion():
+    global _conexion
+    if _conexion is not None:
+        try:
+            _conexion.close()
+        except Exception:
+            pass
+        _conexion = None
+
+_FROM_EMAIL = getattr(settings, "DEFAULT_FROM_EMAIL", None)
+
+# Plantilla HTML compilada una sola vez: render_to_string pasaba por el
+# registro del template engine en cada envío
+_TPL_RESET_HTML = get_template('password_reset_email.html')
+
+# El cuerpo de texto plano no necesita motor de plantillas: es un format
+# string directo (y así la URL no llega HTML-escapada, como pasaba con el
+# autoescape del engine sobre el .txt)
+_CUERPO_RESET_TXT = """{saludo}
+
+Recibimos una solicitud para restablecer la contraseña de tu cuenta en Bella Dent.
+
+Para continuar con el proceso de restablecimiento, abre este enlace en tu navegador:
+
+{reset_url}
+
+Este enlace expirará en 30 minutos por razones de seguridad.
+
+⚠️ IMPORTANTE: Si no solicitaste restablecer tu contraseña, puedes ignorar este correo de forma segura. Tu cuenta en Bella Dent permanecerá protegida.
+
+---
+Bella Dent - Consultorio Dental
+Sistema de Gestión de Citas
+
+Si tienes alguna pregunta, contáctanos en contacto@belladent.com
+
+© {year} Bella Dent. Todos los derechos reservados.
+"""
+
+
+def _cuerpo_reset_txt(context):
+    nombre = context.get('usuario_nombre')
+    return _CUERPO_RESET_TXT.format(
+        saludo=f"Hola, {nombre}" if nombre else "Hola",
+        reset_url=context.get('reset_url', ''),
+        year=context.get('year', ''),
+    )
+
+
+@lru_cache(maxsize=1)
+def _logo_correo():
+    # El logo embebido es un archivo estático: leerlo del disco por cada
+    # correo era puro I/O repetido
+    logo_path = os.path.join(settings.BASE_DIR, 'usuarios', 'static', 'belladent-logo5.png')
+    if os.path.exists(logo_path):
+        with open(logo_path, 'rb') as f:
+            return f.read()
+    return None
+
+
+def _construir_correo_reset(email_destino, context):
+    mensaje = EmailMultiAlternatives(
+        subject="Restablecer contraseña - Bella Dent",
+        body=_cuerpo_reset_txt(context),  # Versión texto plano (fallback)
+        from_email=_FROM_EMAIL,
+        to=[email_destino],
+    )
+    mensaje.attach_alternative(_TPL_RESET_HTML.render(context), "text/html")
+
+    # Adjuntar logo embebido (CID)
+    logo_data = _logo_correo()
+    if logo_data:
+        logo = MIMEImage(logo_data)
+        logo.add_header('Content-ID', '<logo_belladent>')
+        logo.add_header('Content-Disposition', 'inline', filename='belladent-logo5.png')
+        mensaje.attach(logo)
+
+    return mensaje
+
+
+def _enviar_con_reintentos(mensaje):
+    for intento in range(1, MAX_REINTENTOS + 1):
+        try:
+            with _conexion_lock:
+                mensaje.connection = _obtener_conexion()
+                mensaje.send(fail_silently=False)
+            return
+        except SMTPException as e:
+            # La sesión pudo caducar del lado del servidor: se descarta y el
+            # reintento abre una nueva
+            with _conexion_lock:
+                _descartar_conexion()
+            if intento == MAX_REINTENTOS:
+                logger.error(
+                    f"Error al enviar correo a {mensaje.to} tras {intento} intentos: {e}"
+                )
+                return
+            logger.warning(
+                f"Fallo SMTP enviando a {mensaje.to} (intento {intento}): {e}; reintentando"
+            )
+            time.sleep(ESPERA_REINTENTO)
+        except Exception as e:
+            # Errores no-SMTP (configuración, conexión rechazada) no se reintentan
+            with _conexion_lock:
+                _descartar_conexion()
+            logger.error(f"Error al enviar correo a {mensaje.to}: {e}")
+            return
+
+
+def _procesar_reset(email_destino, context):
+    try:
+        mensaje = _construir_correo_reset(email_destino, context)
+    except Exception as e:
+        # Sin exponer el problema al usuario: la vista ya respondió
+        logger.error(f"Error al preparar correo de reset password: {e}")
+        return
+    _enviar_con_reintentos(mensaje)
+
+
+def enviar_reset_password_async(email_destino, context):
+    """
+    Renderiza, arma y envía el correo de reset en un hilo daemon.
+
+    La vista solo resuelve el destinatario y el token; todo el trabajo de
+    plantillas, MIME y SMTP (con reintentos) ocurre fuera de la request.
+    """
+    threading.Thread(target=_procesar_reset, args=(email_destino, context), daemon=True).start()
+
+
+def _destruir_foto(public_id):
+    # Import perezoso: el SDK de Cloudinary solo se paga en el hilo que borra
+    from cloudinary.uploader import destroy
+
+    try:
+        destroy(public_id, resource_type='image')
+    except Exception as e:
+        # La foto nueva ya quedó guardada; un huérfano en Cloudinary no
+        # justifica fallar la operación del usuario
+        logger.warning(f"No se pudo eliminar la foto {public_id} de Cloudinary: {e}")
+
+
+def destruir_foto_cloudinary_async(public_id):
+    """
+    Elimina una foto de Cloudinary en un hilo daemon.
+
+    El destroy es una llamada HTTP al API de Cloudinary; la request solo
+    necesita el resultado de la subida nueva, no el del borrado del anterior.
+    """
+    threading.Thread(target=_destruir_foto, args=(public_id,), daemon=True).start()
+
+
+def enviar_correo_async(mensaje):
+    """
+    Encola un EmailMessage ya construido y retorna de inmediato.
+
+    El mensaje se envía (con reintentos ante errores SMTP transitorios) en un
+    hilo daemon, sin bloquear el worker que atiende la request.
+    """
+    threading.Thread(target=_enviar_con_reintentos, args=(mensaje,), daemon=True).start()
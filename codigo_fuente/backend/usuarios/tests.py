@@ -1,3 +1,71 @@
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
 
-# Create your tests here.
+from usuarios.authentication import _INACTIVA_KEY, _LOCK_KEY
+from usuarios.models import Rol, Usuario
+
+
+class LoginIntentosFallidosTests(TestCase):
+    """
+    Regresión: el login de la API (/api/v1/token/) pasa la cédula como
+    kwarg 'cedula', y el backend de autenticación debe aceptarla; si no,
+    el contador de intentos fallidos nunca se incrementa y el bloqueo
+    escalonado queda muerto para la API.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rol = Rol.objects.create(rol='Paciente')
+        cls.usuario = Usuario.objects.create_user(
+            cedula='0912345678',
+            password='Correcta#123',
+            email='login.test@example.com',
+            primer_nombre='Ana',
+            primer_apellido='López',
+            segundo_apellido='Díaz',
+            fecha_nacimiento='1990-01-15',
+            sexo='F',
+            tipo_sangre='O+',
+            id_rol=rol,
+        )
+
+    def _post_login(self, password):
+        return self.client.post(
+            '/api/v1/token/',
+            {'cedula': '0912345678', 'password': password},
+            content_type='application/json',
+        )
+
+    def test_password_incorrecta_incrementa_contador(self):
+        for esperado in (1, 2):
+            respuesta = self._post_login('incorrecta')
+            self.assertEqual(respuesta.status_code, 400)
+            self.usuario.refresh_from_db()
+            self.assertEqual(self.usuario.intentos_fallidos, esperado)
+
+    def test_login_exitoso_resetea_contador(self):
+        Usuario.objects.filter(pk=self.usuario.pk).update(intentos_fallidos=2)
+        respuesta = self._post_login('Correcta#123')
+        self.assertEqual(respuesta.status_code, 200)
+        self.usuario.refresh_from_db()
+        self.assertEqual(self.usuario.intentos_fallidos, 0)
+
+    def test_reset_admin_limpia_espejo_en_cache(self):
+        # El desbloqueo administrativo debe borrar el espejo del bloqueo en
+        # cache; si queda, el fast path del backend sigue rechazando logins
+        # hasta que venza el TTL original
+        Usuario.objects.filter(pk=self.usuario.pk).update(
+            intentos_fallidos=5,
+            bloqueado_hasta=timezone.now() + timezone.timedelta(minutes=15),
+        )
+        cache.set(_LOCK_KEY.format(self.usuario.cedula), True, 900)
+        cache.set(_INACTIVA_KEY.format(self.usuario.cedula), True, 60)
+
+        self.usuario.refresh_from_db()
+        self.usuario.resetear_intentos_login()
+
+        self.assertIsNone(cache.get(_LOCK_KEY.format(self.usuario.cedula)))
+        self.assertIsNone(cache.get(_INACTIVA_KEY.format(self.usuario.cedula)))
+        respuesta = self._post_login('Correcta#123')
+        self.assertEqual(respuesta.status_code, 200)
@@ -1,21 +1,47 @@
 # usuarios/utils.py
-import re
-import cloudinary
-from cloudinary.uploader import upload
-from cloudinary.utils import cloudinary_url
+# cloudinary y cryptography se importan dentro de las funciones que los usan:
+# cargan bindings pesados (HTTP SDK, OpenSSL) que los procesos que nunca
+# suben fotos ni (des)encriptan URLs no deberían pagar al importar el módulo
+import base64
+import os
 from datetime import date, datetime
+from functools import lru_cache
 from django.core.exceptions import ValidationError
 from django.core.mail import send_mail
 from django.conf import settings
-from cryptography.fernet import Fernet
+
+
+# Tabla para limpiar separadores comunes de teléfonos (espacios en blanco,
+# guiones y paréntesis) de una sola pasada
+_LIMPIAR_CELULAR = str.maketrans('', '', ' \t\n\r\f\v-()')
+
+# Sufijo de los emails ficticios generados para menores sin email propio
+_SUFIJO_EMAIL_FICTICIO = '@oralflow.system'
+_LARGO_SUFIJO = len(_SUFIJO_EMAIL_FICTICIO)
+
+
+def _es_email_ficticio(email):
+    # Chequeo de largo primero: descarta la mayoría de emails reales sin
+    # llegar al endswith (en fan-out de notificaciones se llama por usuario)
+    return bool(email) and len(email) > _LARGO_SUFIJO and email.endswith(_SUFIJO_EMAIL_FICTICIO)
 
 
 # ==========================
 # ENCRIPTACIÓN DE URLs
 # ==========================
 
+# Los valores nuevos se encriptan con AES-GCM (una sola pasada, acelerada
+# por AES-NI) y se marcan con este prefijo; los valores viejos en BD siguen
+# siendo tokens Fernet y se desencriptan con el cipher legado
+_PREFIJO_GCM = 'v2:'
+
+
+@lru_cache(maxsize=1)
 def get_fernet_cipher():
-    # Obtiene la instancia de Fernet para encriptar/desencriptar
+    # Instancia de Fernet memoizada: construirla divide la clave y arma los
+    # contextos AES/HMAC, y esto se llamaba por cada URL (des)encriptada
+    from cryptography.fernet import Fernet
+
     key = settings.FERNET_KEY
     # Asegurarse de que la clave esté en formato bytes
     if isinstance(key, str):
@@ -23,30 +49,46 @@ def get_fernet_cipher():
     return Fernet(key)
 
 
+@lru_cache(maxsize=1)
+def _get_aesgcm():
+    # Reusa la misma clave Fernet: decodificada son 32 bytes crudos, el
+    # tamaño exacto que AES-256-GCM necesita
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    key = settings.FERNET_KEY
+    if isinstance(key, str):
+        key = key.encode()
+    return AESGCM(base64.urlsafe_b64decode(key))
+
+
 def encriptar_url(url: str) -> str:
-    # Encripta una URL usando Fernet
+    # Encripta una URL con AES-GCM (nonce de 12 bytes + ciphertext, en
+    # base64 urlsafe con prefijo de versión)
     if not url:
         return url
-    
+
     try:
-        cipher = get_fernet_cipher()
-        url_bytes = url.encode('utf-8')
-        encrypted_bytes = cipher.encrypt(url_bytes)
-        # Convertir a string para almacenar en BD
-        return encrypted_bytes.decode('utf-8')
+        aesgcm = _get_aesgcm()
+        nonce = os.urandom(12)
+        ct = aesgcm.encrypt(nonce, url.encode('utf-8'), None)
+        return _PREFIJO_GCM + base64.urlsafe_b64encode(nonce + ct).decode('ascii')
     except Exception as e:
         raise Exception(f"Error al encriptar URL: {str(e)}")
 
 
 def desencriptar_url(encrypted_url: str) -> str:
-    # Desencripta una URL encriptada con Fernet
+    # Desencripta una URL: AES-GCM para el formato nuevo, Fernet para los
+    # valores que ya estaban guardados en BD
     if not encrypted_url:
         return encrypted_url
-    
+
     try:
-        cipher = get_fernet_cipher()
-        encrypted_bytes = encrypted_url.encode('utf-8')
-        decrypted_bytes = cipher.decrypt(encrypted_bytes)
+        if encrypted_url.startswith(_PREFIJO_GCM):
+            datos = base64.urlsafe_b64decode(encrypted_url[len(_PREFIJO_GCM):])
+            decrypted_bytes = _get_aesgcm().decrypt(datos[:12], datos[12:], None)
+        else:
+            cipher = get_fernet_cipher()
+            decrypted_bytes = cipher.decrypt(encrypted_url.encode('utf-8'))
         return decrypted_bytes.decode('utf-8')
     except Exception as e:
         raise Exception(f"Error al desencriptar URL: {str(e)}")
@@ -70,9 +112,10 @@ def normalizar_celular_ecuador(celular: str | None) -> str | None:
     """
     if not celular:
         return None
-    
-    # Limpiar espacios, guiones, paréntesis
-    celular = re.sub(r'[\s\-\(\)]', '', str(celular))
+
+    # Limpiar espacios, guiones, paréntesis (translate: bucle en C, sin
+    # motor de regex)
+    celular = str(celular).translate(_LIMPIAR_CELULAR)
     
     # Si ya está en formato E.164 correcto, retornar
     if celular.startswith('+593') and len(celular) == 13:
@@ -115,12 +158,20 @@ def obtener_contacto_notificacion(usuario):
     celular_tipo = "propio"
     
     # Si el usuario es paciente y tiene email ficticio o no tiene celular,
-    # usar datos del contacto de emergencia
-    if hasattr(usuario, 'paciente'):
-        paciente = usuario.paciente
-        
+    # usar datos del contacto de emergencia. Se consulta primero el cache de
+    # la relación (lo llena el select_related del caller): hasattr sobre el
+    # one-to-one inverso dispara una query oculta por usuario en los envíos
+    # masivos
+    if 'paciente' in usuario._state.fields_cache:
+        paciente = usuario._state.fields_cache['paciente']
+    else:
+        from pacientes.models import Paciente
+        paciente = Paciente.objects.filter(id_usuario=usuario).first()
+
+    if paciente is not None:
+
         # Si tiene email ficticio, usar email del contacto
-        if usuario.email and usuario.email.endswith('@oralflow.system'):
+        if _es_email_ficticio(usuario.email):
             email_destino = paciente.contacto_emergencia_email or usuario.email
         
         # Si no tiene celular, usar celular del contacto
@@ -149,13 +200,16 @@ def validar_registro_publico(data):
     if not fecha_nac:
         raise ValidationError('La fecha de nacimiento es obligatoria')
     
-    # Calcular edad
+    # Mayor de 18 ⇔ nació en o antes de (hoy - 18 años): una sola
+    # comparación de fechas en vez de calcular la edad con ramas
     hoy = date.today()
-    edad = hoy.year - fecha_nac.year
-    if (hoy.month, hoy.day) < (fecha_nac.month, fecha_nac.day):
-        edad -= 1
-    
-    if edad < 18:
+    try:
+        umbral = hoy.replace(year=hoy.year - 18)
+    except ValueError:
+        # 29 de febrero sin equivalente 18 años atrás
+        umbral = hoy.replace(year=hoy.year - 18, day=28)
+
+    if fecha_nac > umbral:
         raise ValidationError(
             'Los menores de 18 años deben ser registrados presencialmente '
             'en el consultorio junto con su representante legal.'
@@ -171,7 +225,7 @@ def validar_registro_publico(data):
 def validar_datos_paciente_menor(usuario_data, paciente_data):
     # Valida que un menor tenga los datos requeridos en Usuario y Paciente.
     # Si el menor no tiene email propio, debe tener email en contacto de emergencia
-    tiene_email_propio = usuario_data.get('email') and not usuario_data.get('email', '').endswith('@oralflow.system')
+    tiene_email_propio = usuario_data.get('email') and not _es_email_ficticio(usuario_data['email'])
     tiene_email_contacto = paciente_data.get('contacto_emergencia_email')
     
     if not tiene_email_propio and not tiene_email_contacto:
@@ -184,6 +238,8 @@ def validar_datos_paciente_menor(usuario_data, paciente_data):
         raise ValidationError('El celular del contacto de emergencia es obligatorio')
 
 def subir_foto_perfil_cloudinary(archivo, cedula):
+    import cloudinary.uploader
+
     try:
         # Validar tamaño del archivo (máximo 5MB)
         max_size = 5 * 1024 * 1024  # 5MB en bytes
@@ -209,9 +265,13 @@ def subir_foto_perfil_cloudinary(archivo, cedula):
         # Generar el nombre del archivo
         nombre_archivo = f"perfil_{cedula}"
         
-        # Subir a Cloudinary con optimización automática
-        resultado = cloudinary.uploader.upload(
+        # Subir a Cloudinary con optimización automática. upload_large lee
+        # el archivo por chunks en vez de materializarlo entero en memoria;
+        # 5MB es el chunk mínimo que acepta la API, y coincide con nuestro
+        # tope, así que los archivos válidos viajan en una sola pasada
+        resultado = cloudinary.uploader.upload_large(
             archivo,
+            chunk_size=5 * 1024 * 1024,
             folder="perfiles",
             resource_type="image",
             public_id=nombre_archivo,
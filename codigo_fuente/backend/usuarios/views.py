@@ -2,28 +2,29 @@
 from django.conf import settings
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.contrib.auth.password_validation import validate_password
+from django.core.cache import cache
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import OperationalError
+from django.db.models import OuterRef, Q, Subquery
 from django.utils.encoding import force_bytes, force_str
-from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.utils.http import int_to_base36, urlsafe_base64_decode
 
 from rest_framework import viewsets, status, throttling
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import BasePermission, IsAuthenticated, AllowAny
 from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
 
-from cloudinary.uploader import destroy
 from usuarios.utils import subir_foto_perfil_cloudinary
-from urllib.parse import urlparse
 
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+from base64 import urlsafe_b64encode
 from datetime import datetime
-from email.mime.image import MIMEImage
-import os
+import hashlib
+import hmac
 
-from .models import Rol, Usuario
+from .models import Rol, Usuario, _CEDULA_RE, _CELULAR_RE
+from .tasks import destruir_foto_cloudinary_async, enviar_reset_password_async
 from .serializers import (
     RolSerializer,
     UsuarioSerializer,
@@ -36,7 +37,48 @@ from .serializers import (
 # Importar modelos de pacientes y odontólogos para verificar roles adicionales
 from pacientes.models import Paciente
 from odontologos.models import Odontologo
-from usuarios.utils import subir_foto_perfil_cloudinary
+
+# -----------------------------
+# Cortocircuito ante caídas de la BD
+# -----------------------------
+# Cuando Postgres no responde, cada request a los endpoints públicos cuelga
+# un worker durante el connect-timeout completo. Tras varios errores
+# operacionales seguidos se "abre el circuito": los siguientes requests
+# reciben 503 al instante durante unos segundos, sin tocar la BD, y los
+# workers quedan libres para los endpoints sanos. El estado vive en el
+# cache, así que con Redis lo comparten todos los workers.
+
+_BREAKER_FALLOS_KEY = 'db:breaker:fallos'
+_BREAKER_ABIERTO_KEY = 'db:breaker:abierto'
+_BREAKER_MAX_FALLOS = 5    # fallos en la ventana antes de abrir
+_BREAKER_VENTANA = 60      # segundos de la ventana de conteo
+_BREAKER_TTL = 30          # segundos que el circuito queda abierto
+
+
+def _breaker_abierto():
+    return cache.get(_BREAKER_ABIERTO_KEY) is not None
+
+
+def _registrar_fallo_db():
+    if cache.add(_BREAKER_FALLOS_KEY, 1, _BREAKER_VENTANA):
+        fallos = 1
+    else:
+        try:
+            fallos = cache.incr(_BREAKER_FALLOS_KEY)
+        except ValueError:
+            cache.add(_BREAKER_FALLOS_KEY, 1, _BREAKER_VENTANA)
+            fallos = 1
+    if fallos >= _BREAKER_MAX_FALLOS:
+        cache.set(_BREAKER_ABIERTO_KEY, 1, _BREAKER_TTL)
+
+
+def _respuesta_db_caida():
+    return Response(
+        {"detail": "Servicio temporalmente no disponible. Intenta más tarde."},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(_BREAKER_TTL)},
+    )
+
 
 # -----------------------------
 # Vista personalizada para Token con actualización de last_login
@@ -75,43 +117,63 @@ def obtener_public_id(url):
     if not url:
         return None
 
-    try:
-        path = urlparse(url).path.strip('/')  
-        partes = path.split('/')  
-        if 'upload' not in partes:
-            return None
-        
-        idx_upload = partes.index('upload')
+    # Cortes directos sobre el string: urlparse + split('/') + index hacían
+    # varias pasadas y listas intermedias para extraer una subcadena fija
+    inicio = url.find('/upload/')
+    if inicio < 0:
+        return None
+    resto = url[inicio + 8:]
 
-        # Ignorar todo hasta después del "upload"
-        partes_utiles = partes[idx_upload + 1:]  
+    # Descartar query string / fragmento si existieran
+    for sep in ('?', '#'):
+        corte = resto.find(sep)
+        if corte >= 0:
+            resto = resto[:corte]
 
-        # Si lo siguiente es versión v12345, saltarlo
-        if partes_utiles and partes_utiles[0].startswith('v') and partes_utiles[0][1:].isdigit():
-            partes_utiles = partes_utiles[1:]
+    # Si lo siguiente es versión v12345, saltarlo
+    if resto[:1] == 'v':
+        corte = resto.find('/')
+        if corte > 1 and resto[1:corte].isdigit():
+            resto = resto[corte + 1:]
 
-        # Último elemento es archivo.ext
-        archivo = partes_utiles[-1]  
-        nombre = archivo.rsplit('.', 1)[0]  
+    if not resto:
+        return None
 
-        carpetas = partes_utiles[:-1]  
-        if carpetas:
-            carpeta = "/".join(carpetas)
-            return f"{carpeta}/{nombre}"
-        else:
-            return nombre
+    # Quitar la extensión del último segmento
+    punto = resto.rfind('.')
+    if punto > resto.rfind('/'):
+        resto = resto[:punto]
+    return resto or None
+
+class IsSelfOrAdmin(BasePermission):
+    # Solo el propio usuario o un administrador pueden tocar el objeto;
+    # get_object() la evalúa vía check_object_permissions
+    message = 'No tienes permiso para modificar esta foto'
+
+    def has_object_permission(self, request, view, obj):
+        return (
+            request.user.id_usuario == obj.id_usuario
+            or request.user.id_rol_id == 1
+        )
 
-    except Exception:
-        return None
 
 class UsuarioViewSet(viewsets.ModelViewSet):
-    queryset = Usuario.objects.all()
+    # id_paciente resuelto como subconsulta escalar en la misma query: más
+    # liviano que traer toda la fila de paciente con select_related y sin
+    # SELECT por fila en los listados (el rol ya lo une el manager)
+    queryset = Usuario.objects.annotate(
+        _id_paciente=Subquery(
+            Paciente.objects.filter(id_usuario=OuterRef('pk')).values('id_paciente')[:1]
+        )
+    )
     serializer_class = UsuarioSerializer
 
     # Permitir crear SIN autenticación; el resto requiere token
     def get_permissions(self):
         if self.action in ["create", "verificar"]:
             return [AllowAny()]
+        if self.action == "actualizar_foto":
+            return [IsAuthenticated(), IsSelfOrAdmin()]
         return [IsAuthenticated()]
 
     @action(detail=False, methods=['get'], url_path='me', permission_classes=[IsAuthenticated])
@@ -131,21 +193,52 @@ class UsuarioViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        # Prefiltro de formato: los validadores del modelo garantizan que
+        # un valor malformado no puede existir en la tabla, así que acá se
+        # responde exists=False sin consulta (el endpoint es público y
+        # recibe escaneos con basura)
         data = {"ok": True}
-        if cedula:
+        if cedula and not _CEDULA_RE.match(cedula):
+            data["cedula"] = {"value": cedula, "exists": False}
+        if email and ('@' not in email or len(email) > 254):
+            data["email"] = {"value": email, "exists": False}
+        if celular and not _CELULAR_RE.match(celular):
+            data["celular"] = {"value": celular, "exists": False}
+
+        # Una sola consulta con OR para los valores bien formados; la
+        # pertenencia por campo se resuelve en Python sobre las pocas filas
+        # candidatas
+        filtros = Q()
+        if cedula and "cedula" not in data:
+            filtros |= Q(cedula=cedula)
+        if email and "email" not in data:
+            filtros |= Q(email=email)
+        if celular and "celular" not in data:
+            filtros |= Q(celular=celular)
+        if filtros and _breaker_abierto():
+            return _respuesta_db_caida()
+        try:
+            filas = list(
+                Usuario.objects.filter(filtros).values_list('cedula', 'email', 'celular')
+            ) if filtros else []
+        except OperationalError:
+            _registrar_fallo_db()
+            return _respuesta_db_caida()
+
+        if cedula and "cedula" not in data:
             data["cedula"] = {
                 "value": cedula,
-                "exists": Usuario.objects.filter(cedula=cedula).exists(),
+                "exists": any(fila[0] == cedula for fila in filas),
             }
-        if email:
+        if email and "email" not in data:
             data["email"] = {
                 "value": email,
-                "exists": Usuario.objects.filter(email=email).exists(),
+                "exists": any(fila[1] == email for fila in filas),
             }
-        if celular:
+        if celular and "celular" not in data:
             data["celular"] = {
                 "value": celular,
-                "exists": Usuario.objects.filter(celular=celular).exists(),
+                "exists": any(fila[2] == celular for fila in filas),
             }
 
         return Response(data, status=status.HTTP_200_OK)
@@ -162,36 +255,32 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         - es_admin: true si is_staff=true (admin o admin clínico)
         """
         usuario = self.get_object()
-        
-        # Verificar si tiene registro de paciente
-        tiene_paciente = False
-        id_paciente = None
-        try:
-            paciente = Paciente.objects.get(id_usuario=usuario)
-            tiene_paciente = True
-            id_paciente = paciente.id_paciente
-        except Paciente.DoesNotExist:
-            pass
-        
-        # Verificar si tiene registro de odontólogo
-        tiene_odontologo = False
-        id_odontologo = None
-        odontologo_activo = None
-        try:
-            odontologo = Odontologo.objects.get(id_usuario=usuario)
-            tiene_odontologo = True
-            id_odontologo = odontologo.id_odontologo
-            odontologo_activo = odontologo.activo
-        except Odontologo.DoesNotExist:
-            pass
-        
+
+        # El queryset del ViewSet ya trae _id_paciente anotado y el rol en
+        # el mismo JOIN, así que paciente no cuesta consulta extra; para
+        # odontólogo alcanza una consulta estrecha de dos columnas en vez
+        # de hidratar el modelo con get() + try/except
+        id_paciente = usuario._id_paciente
+
+        datos_odontologo = (
+            Odontologo.objects
+            .filter(id_usuario=usuario)
+            .values_list('id_odontologo', 'activo')
+            .first()
+        )
+        if datos_odontologo is not None:
+            id_odontologo, odontologo_activo = datos_odontologo
+        else:
+            id_odontologo = None
+            odontologo_activo = None
+
         return Response({
             "id_usuario": usuario.id_usuario,
             "email": usuario.email,
             "rol_principal": usuario.id_rol_id,
             "rol_principal_nombre": usuario.id_rol.rol,
-            "es_paciente": tiene_paciente,
-            "es_odontologo": tiene_odontologo,
+            "es_paciente": id_paciente is not None,
+            "es_odontologo": datos_odontologo is not None,
             "id_paciente": id_paciente,
             "id_odontologo": id_odontologo,
             "odontologo_activo": odontologo_activo,
@@ -241,22 +330,28 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         Siempre retorna 200 con campo 'existe' (true/false).
         """
         usuario = self.get_object()
-        
-        try:
-            paciente = Paciente.objects.get(id_usuario=usuario)
-            return Response({
-                "existe": True,
-                "id_paciente": paciente.id_paciente,
-                "contacto_emergencia_nom": paciente.contacto_emergencia_nom,
-                "contacto_emergencia_cel": paciente.contacto_emergencia_cel,
-                "contacto_emergencia_par": paciente.contacto_emergencia_par,
-            })
-        except Paciente.DoesNotExist:
+
+        # La anotación _id_paciente del queryset responde la inexistencia
+        # sin consulta extra; solo cuando hay paciente se traen las columnas
+        # de contacto que expone la respuesta
+        if usuario._id_paciente is None:
             return Response({
                 "existe": False,
                 "mensaje": "Este usuario no tiene registro de paciente"
             })
 
+        contacto = Paciente.objects.values(
+            'contacto_emergencia_nom', 'contacto_emergencia_cel',
+            'contacto_emergencia_par',
+        ).get(id_paciente=usuario._id_paciente)
+        return Response({
+            "existe": True,
+            "id_paciente": usuario._id_paciente,
+            "contacto_emergencia_nom": contacto['contacto_emergencia_nom'],
+            "contacto_emergencia_cel": contacto['contacto_emergencia_cel'],
+            "contacto_emergencia_par": contacto['contacto_emergencia_par'],
+        })
+
     @action(detail=True, methods=['get'], url_path='verificar-rol-odontologo', permission_classes=[IsAuthenticated])
     def verificar_rol_odontologo(self, request, pk=None):
         """
@@ -264,20 +359,26 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         Siempre retorna 200 con campo 'existe' (true/false).
         """
         usuario = self.get_object()
-        
-        try:
-            odontologo = Odontologo.objects.get(id_usuario=usuario)
-            return Response({
-                "existe": True,
-                "id_odontologo": odontologo.id_odontologo,
-                "id_consultorio_defecto": odontologo.id_consultorio_defecto_id,
-            })
-        except Odontologo.DoesNotExist:
+
+        # Consulta estrecha de dos columnas en vez de hidratar el modelo
+        datos = (
+            Odontologo.objects
+            .filter(id_usuario=usuario)
+            .values_list('id_odontologo', 'id_consultorio_defecto_id')
+            .first()
+        )
+        if datos is None:
             return Response({
                 "existe": False,
                 "mensaje": "Este usuario no tiene registro de odontólogo"
             })
 
+        return Response({
+            "existe": True,
+            "id_odontologo": datos[0],
+            "id_consultorio_defecto": datos[1],
+        })
+
     @action(detail=True, methods=['post'], url_path='previsualizar-cambio-staff', permission_classes=[IsAuthenticated])
     def previsualizar_cambio_staff(self, request, pk=None):
         """
@@ -300,8 +401,9 @@ class UsuarioViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Verificar si tiene registro de paciente
-        tiene_paciente = Paciente.objects.filter(id_usuario=usuario).exists()
+        # Verificar si tiene registro de paciente: la anotación _id_paciente
+        # del queryset ya responde esto sin otra query EXISTS
+        tiene_paciente = usuario._id_paciente is not None
         
         # Cambiar de admin (is_staff=true) a no-admin (is_staff=false)
         if usuario.is_staff and not nuevo_is_staff:
@@ -342,7 +444,7 @@ class UsuarioViewSet(viewsets.ModelViewSet):
             "tiene_paciente": tiene_paciente,
         })
     
-    @action(detail=True, methods=['patch'], url_path='foto', permission_classes=[IsAuthenticated])
+    @action(detail=True, methods=['patch'], url_path='foto', permission_classes=[IsAuthenticated, IsSelfOrAdmin])
     def actualizar_foto(self, request, pk=None):
         """
         Actualiza o elimina la foto de perfil del usuario.
@@ -352,26 +454,19 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         
         usuario = self.get_object()
         
-        # Verificar permisos: solo el mismo usuario o admin
-        if request.user.id_usuario != usuario.id_usuario and request.user.id_rol_id != 1:
-            return Response(
-                {'detail': 'No tienes permiso para modificar esta foto'},
-                status=status.HTTP_403_FORBIDDEN
-            )
-        
         # Opción 1: Eliminar foto
         if request.data.get('foto_remove') == 'true':
             foto_anterior = usuario.get_foto_desencriptada()
             if foto_anterior:
                 public_id_anterior = obtener_public_id(foto_anterior)
                 if public_id_anterior:
-                    try:
-                        destroy(public_id_anterior, resource_type='image')
-                    except Exception:
-                        pass
+                    # Borrado en Cloudinary fuera de la request
+                    destruir_foto_cloudinary_async(public_id_anterior)
             
             usuario.foto = None
-            usuario.save(update_fields=['foto'])
+            # UPDATE directo: save() dispara señales y lógica de save() del
+            # modelo que este cambio de una sola columna no necesita
+            Usuario.objects.filter(pk=usuario.pk).update(foto=None)
             
             serializer = self.get_serializer(usuario)
             return Response(serializer.data)
@@ -390,17 +485,17 @@ class UsuarioViewSet(viewsets.ModelViewSet):
             if foto_anterior:
                 public_id_anterior = obtener_public_id(foto_anterior)
                 if public_id_anterior:
-                    try:
-                        destroy(public_id_anterior, resource_type='image')
-                    except Exception:
-                        pass
+                    # Borrado en Cloudinary fuera de la request
+                    destruir_foto_cloudinary_async(public_id_anterior)
             
             # 2. Subir nueva foto a Cloudinary
             url_nueva = subir_foto_perfil_cloudinary(archivo, usuario.cedula)
             
             # 3. Encriptar y guardar la URL
             usuario.set_foto_encriptada(url_nueva)
-            usuario.save(update_fields=['foto'])
+            # La instancia en memoria ya tiene el valor para el serializer;
+            # a BD va un UPDATE directo de la columna
+            Usuario.objects.filter(pk=usuario.pk).update(foto=usuario.foto)
             
             # 4. Retornar datos actualizados con URL desencriptada
             serializer = self.get_serializer(usuario)
@@ -416,61 +511,177 @@ class UsuarioViewSet(viewsets.ModelViewSet):
 # Endpoints: Password Reset
 # -----------------------------
 
-token_generator = PasswordResetTokenGenerator()
+class _TokenGeneratorCacheado(PasswordResetTokenGenerator):
+    # La clave HMAC derivada depende solo de key_salt + SECRET_KEY (constantes
+    # del proceso), pero salted_hmac la recalcula con un SHA extra en cada
+    # make_token/check_token. Se deriva una vez por secreto (el titular y los
+    # fallbacks de rotación) y se reusa.
+
+    def __init__(self):
+        super().__init__()
+        self._claves_hmac = {}
+
+    def _make_token_with_timestamp(self, user, timestamp, secret):
+        clave = self._claves_hmac.get(secret)
+        if clave is None:
+            hasher = getattr(hashlib, self.algorithm)
+            clave = hasher(
+                force_bytes(self.key_salt) + force_bytes(secret)
+            ).digest()
+            self._claves_hmac[secret] = clave
+        ts_b36 = int_to_base36(timestamp)
+        hash_string = hmac.new(
+            clave,
+            msg=force_bytes(self._make_hash_value(user, timestamp)),
+            digestmod=self.algorithm,
+        ).hexdigest()[::2]
+        return f"{ts_b36}-{hash_string}"
+
+
+token_generator = _TokenGeneratorCacheado()
+
+# Resueltos una vez al importar: LazySettings.__getattr__ toma un lock por
+# acceso y estos valores no cambian en vida del proceso
+_FRONTEND_URL = getattr(settings, "FRONTEND_URL", "http://localhost:5173")
+
+# Usuario centinela (nunca guardado) para igualar el costo criptográfico de
+# las ramas que no envían correo: sin el make_token de señuelo, la respuesta
+# rápida de esas ramas delata por timing si una cédula está registrada
+_USUARIO_SENTINELA = Usuario(pk=0, password='', last_login=None, email='')
+
+
+def _respuesta_generica_reset():
+    token_generator.make_token(_USUARIO_SENTINELA)
+    return Response({"detail": "Si la cédula está registrada, se enviará un correo al email asociado."})
+
+class ContadorAtomicoThrottle(throttling.SimpleRateThrottle):
+    """
+    Throttle de ventana fija sobre contadores atómicos del cache.
+
+    El allow_request por defecto de DRF lee la lista de timestamps, la edita
+    en Python y la reescribe: bajo concurrencia dos requests pueden pasar el
+    límite a la vez. cache.add + incr son atómicos (en LocMem y en Redis),
+    así que el conteo queda correcto con una sola operación por request —
+    mismo patrón que el contador de fallos por IP del backend de login.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        # add abre la ventana con su TTL; si ya existía, incr acumula sobre
+        # la ventana vigente
+        if self.cache.add(self.key, 1, self.duration):
+            contador = 1
+        else:
+            try:
+                contador = self.cache.incr(self.key)
+            except ValueError:
+                # La clave expiró entre el add y el incr: nueva ventana
+                self.cache.add(self.key, 1, self.duration)
+                contador = 1
+        return contador <= self.num_requests
+
+    def wait(self):
+        # Sin la lista de timestamps no hay resto exacto de la ventana;
+        # se reporta la ventana completa como Retry-After conservador
+        return self.duration
+
 
-class PasswordResetRequestThrottle(throttling.AnonRateThrottle):
+class PasswordResetRequestThrottle(ContadorAtomicoThrottle, throttling.AnonRateThrottle):
     # Limitar solicitudes anónimas para evitar abuso.
     scope = "password_reset_request"
 
 
+class PasswordResetCedulaThrottle(ContadorAtomicoThrottle):
+    # Segundo límite, por cédula objetivo: el límite por IP no frena a un
+    # atacante que rota IPs contra la misma cuenta (y cada solicitud cuesta
+    # un envío SMTP). Se guarda un hash de la cédula, no el dato en claro.
+    scope = "password_reset_cedula"
+
+    def get_cache_key(self, request, view):
+        cedula = str(request.data.get("cedula", "")).strip()
+        if not cedula:
+            # Sin cédula el serializer rechaza la request; no hay qué limitar
+            return None
+        huella = hashlib.sha256(cedula.encode()).hexdigest()
+        return self.cache_format % {"scope": self.scope, "ident": huella}
+
+
+def _ocultar_email(email):
+    # Enmascara el email para mostrarlo sin revelarlo completo
+    if not email or "@" not in email:
+        return "***@***.com"
+    local, dominio = email.split("@", 1)
+    if len(local) <= 3:
+        local_oculto = "***"
+    else:
+        local_oculto = local[:2] + "***"
+    return f"{local_oculto}@{dominio}"
+
+
 class PasswordResetRequestView(APIView):
     """
     Busca al usuario por cédula y envía el correo al email asociado.
     Si el email es @oralflow (dummy) y el usuario es paciente, envía al contacto de emergencia.
     """
     permission_classes = [AllowAny]
-    throttle_classes = [PasswordResetRequestThrottle]
+    throttle_classes = [PasswordResetRequestThrottle, PasswordResetCedulaThrottle]
 
     def post(self, request):
-        from pacientes.models import Paciente
-        
         ser = PasswordResetRequestSer(data=request.data)
         ser.is_valid(raise_exception=True)
         cedula = ser.validated_data["cedula"].strip()
 
+        if _breaker_abierto():
+            return _respuesta_db_caida()
+
         try:
-            user = Usuario.objects.get(cedula=cedula)
+            # Solo las columnas que usan el token (pk/password/last_login/
+            # email) y el cuerpo del correo: evita hidratar la fila completa.
+            # El JOIN a paciente trae el email de contacto en la misma query
+            # (antes era una segunda query para los emails dummy)
+            # select_related(None) descarta el JOIN a rol que agrega el
+            # manager: con id_rol diferido por el only() no puede compilar
+            user = Usuario.objects.select_related(None).select_related('paciente').only(
+                'id_usuario', 'cedula', 'email', 'password', 'last_login',
+                'primer_nombre', 'primer_apellido',
+                'paciente__id_paciente', 'paciente__contacto_emergencia_email',
+            ).get(cedula=cedula)
+        except OperationalError:
+            _registrar_fallo_db()
+            return _respuesta_db_caida()
         except Usuario.DoesNotExist:
-            # No revelar existencia de la cédula
-            return Response({"detail": "Si la cédula está registrada, se enviará un correo al email asociado."})
+            # No revelar existencia de la cédula (ni por el cuerpo ni por el tiempo)
+            return _respuesta_generica_reset()
 
         # Determinar email destino
         email_destino = user.email
         es_dummy = email_destino and "@oralflow" in email_destino.lower()
         
-        # Si es email dummy, buscar el contacto de emergencia (solo para pacientes)
+        # Si es email dummy, usar el contacto de emergencia (solo para pacientes);
+        # el select_related ya dejó la relación en cache (None si no es paciente)
         if es_dummy:
-            try:
-                paciente = Paciente.objects.get(id_usuario=user)
-                if paciente.contacto_emergencia_email:
-                    email_destino = paciente.contacto_emergencia_email
-                else:
-                    # Sin email válido, no se puede enviar
-                    return Response({"detail": "Si la cédula está registrada, se enviará un correo al email asociado."})
-            except Paciente.DoesNotExist:
-                # No es paciente y tiene email dummy, no se puede enviar
-                return Response({"detail": "Si la cédula está registrada, se enviará un correo al email asociado."})
+            paciente = user._state.fields_cache.get('paciente')
+            if paciente is not None and paciente.contacto_emergencia_email:
+                email_destino = paciente.contacto_emergencia_email
+            else:
+                # No es paciente o no tiene email de contacto: no se puede enviar
+                return _respuesta_generica_reset()
         
         if not email_destino:
             # Sin email válido
-            return Response({"detail": "Si la cédula está registrada, se enviará un correo al email asociado."})
+            return _respuesta_generica_reset()
 
-        # Generar token y enviar correo
-        uid = urlsafe_base64_encode(force_bytes(user.pk))
+        # Generar token y enviar correo. base64 directo sobre el pk:
+        # urlsafe_base64_encode(force_bytes(...)) agrega dos wrappers para el
+        # mismo resultado (el pk es un int sin padding que recortar aparte)
+        uid = urlsafe_b64encode(str(user.pk).encode('ascii')).rstrip(b'=').decode('ascii')
         token = token_generator.make_token(user)
 
-        front_url = getattr(settings, "FRONTEND_URL", "http://localhost:5173")
-        reset_url = f"{front_url}/reset-password?uid={uid}&token={token}"
+        reset_url = f"{_FRONTEND_URL}/reset-password?uid={uid}&token={token}"
 
         # Preparar contexto para las plantillas
         context = {
@@ -480,52 +691,12 @@ class PasswordResetRequestView(APIView):
         }
 
         # Ocultar parcialmente el email para mostrarlo al usuario
-        def ocultar_email(email):
-            if not email or "@" not in email:
-                return "***@***.com"
-            local, dominio = email.split("@", 1)
-            if len(local) <= 3:
-                local_oculto = "***"
-            else:
-                local_oculto = local[:2] + "***"
-            return f"{local_oculto}@{dominio}"
-        
-        email_mostrado = ocultar_email(email_destino)
-        
-        # Intentar enviar el correo (con manejo de errores para evitar exponer problemas de SMTP)
-        try:
-            # Renderizar plantillas HTML y texto
-            html_content = render_to_string('password_reset_email.html', context)
-            text_content = render_to_string('password_reset_email.txt', context)
-            
-            # Crear email con HTML
-            email = EmailMultiAlternatives(
-                subject="Restablecer contraseña - Bella Dent",
-                body=text_content,  # Versión texto plano (fallback)
-                from_email=getattr(settings, "DEFAULT_FROM_EMAIL", None),
-                to=[email_destino],
-            )
-            email.attach_alternative(html_content, "text/html")
-
-            # Adjuntar logo embebido (CID)
-            logo_path = os.path.join(settings.BASE_DIR, 'usuarios', 'static', 'belladent-logo5.png')
-            if os.path.exists(logo_path):
-                with open(logo_path, 'rb') as f:
-                    logo_data = f.read()
-                
-                logo = MIMEImage(logo_data)
-                logo.add_header('Content-ID', '<logo_belladent>')
-                logo.add_header('Content-Disposition', 'inline', filename='belladent-logo5.png')
-                email.attach(logo)
-
-            email.send(fail_silently=False)
-        except Exception as e:
-            # Log del error para debugging (sin exponerlo al usuario)
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error al enviar correo de reset password: {str(e)}")
-            # Retornar respuesta exitosa al usuario de todos modos (por seguridad)
-        
+        email_mostrado = _ocultar_email(email_destino)
+
+        # Todo el trabajo de plantillas, MIME y SMTP ocurre en el hilo de la
+        # tarea; la request solo pagó la búsqueda del usuario y el token
+        enviar_reset_password_async(email_destino, context)
+
         return Response({
             "detail": f"Si la cédula está registrada, se enviará un correo a {email_mostrado}",
             "email": email_mostrado
@@ -541,10 +712,28 @@ class PasswordResetValidateView(APIView):
         uid = ser.validated_data["uid"]
         token = ser.validated_data["token"]
 
+        # uid malformado se rechaza acá, sin consulta a la BD: es el camino
+        # barato que toma un escaneo de tokens. Excepciones concretas en vez
+        # de un except Exception que atrape cualquier cosa
+        try:
+            user_id = int(force_str(urlsafe_base64_decode(uid)))
+        except (TypeError, ValueError):
+            return Response({"detail": "Enlace inválido."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if _breaker_abierto():
+            return _respuesta_db_caida()
+
         try:
-            user_id = force_str(urlsafe_base64_decode(uid))
-            user = Usuario.objects.get(pk=user_id)
-        except Exception:
+            # check_token solo mira pk/password/last_login/email
+            # Sin el JOIN a rol del manager: id_rol diferido + select_related
+            # no compilan juntos, y el chequeo de token no usa el rol
+            user = Usuario.objects.select_related(None).only(
+                'id_usuario', 'email', 'password', 'last_login'
+            ).get(pk=user_id)
+        except OperationalError:
+            _registrar_fallo_db()
+            return _respuesta_db_caida()
+        except Usuario.DoesNotExist:
             return Response({"detail": "Enlace inválido."}, status=status.HTTP_400_BAD_REQUEST)
 
         if token_generator.check_token(user, token):
@@ -562,10 +751,26 @@ class PasswordResetConfirmView(APIView):
         token = ser.validated_data["token"]
         new_password = ser.validated_data["new_password"]
 
+        # Igual que en la validación: uid malformado no llega a Postgres
         try:
-            user_id = force_str(urlsafe_base64_decode(uid))
-            user = Usuario.objects.get(pk=user_id)
-        except Exception:
+            user_id = int(force_str(urlsafe_base64_decode(uid)))
+        except (TypeError, ValueError):
+            return Response({"detail": "Enlace inválido."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if _breaker_abierto():
+            return _respuesta_db_caida()
+
+        try:
+            # Alcanza con lo que usan check_token/check_password/set_password
+            # Sin el JOIN a rol del manager: id_rol diferido + select_related
+            # no compilan juntos, y el chequeo de token no usa el rol
+            user = Usuario.objects.select_related(None).only(
+                'id_usuario', 'email', 'password', 'last_login'
+            ).get(pk=user_id)
+        except OperationalError:
+            _registrar_fallo_db()
+            return _respuesta_db_caida()
+        except Usuario.DoesNotExist:
             return Response({"detail": "Enlace inválido."}, status=status.HTTP_400_BAD_REQUEST)
 
         if not token_generator.check_token(user, token):
@@ -585,5 +790,7 @@ class PasswordResetConfirmView(APIView):
             return Response({"new_password": e.messages}, status=status.HTTP_400_BAD_REQUEST)
 
         user.set_password(new_password)
-        user.save(update_fields=["password"])
+        # UPDATE dirigido en vez de save(): una sola columna, sin despacho
+        # de señales ni maquinaria de save_base en el camino caliente
+        Usuario.objects.filter(pk=user.pk).update(password=user.password)
         return Response({"detail": "Contraseña actualizada."})
\ No newline at end of file